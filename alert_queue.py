@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+from dotenv import load_dotenv
+
+from metrics import FEED_ITEMS, Gauge
+
+
+load_dotenv()
+
+# An alert still waiting after this many seconds goes behind every fresh one...
+ALERT_STALE_AFTER = float(os.environ.get("ALERT_STALE_AFTER", 300))
+# ...and is dropped after this many. Setting both the same drops stale alerts outright.
+ALERT_DROP_AFTER = float(os.environ.get("ALERT_DROP_AFTER", 1800))
+# Alerts handed to the outbox at the same time; each one already fans out to all its chats.
+ALERT_SENDERS = int(os.environ.get("ALERT_SENDERS", 2))
+
+
+class PendingAlert:
+    __slots__ = ("feed", "key", "priority", "queued_at", "send", "on_done", "cancelled")
+
+    def __init__(self, feed, key, priority, queued_at, send, on_done):
+        self.feed = feed
+        self.key = key
+        self.priority = priority
+        self.queued_at = queued_at
+        self.send = send
+        self.on_done = on_done
+        self.cancelled = False
+
+
+class AlertQueue:
+    """Rendered alerts waiting for dispatch, most valuable and freshest first.
+
+    Alerts are ordered by their feed's priority, then newest first, so under
+    a burst the send budget goes to fresh alerts of the important feeds. A
+    newer version of the same (feed, chainId, tokenAddress) replaces the one
+    still waiting. An alert that waited ``stale_after`` seconds is demoted
+    behind every fresh alert, and dropped after ``drop_after``.
+
+    ``on_done`` is called with the result of ``send()``, or None when the
+    alert was replaced or dropped without being sent.
+    """
+
+    def __init__(self, stale_after=ALERT_STALE_AFTER, drop_after=ALERT_DROP_AFTER):
+        self.stale_after = stale_after
+        self.drop_after = drop_after
+        self.heap = []
+        self.pending = {}
+        self.order = itertools.count()
+        self.ready = asyncio.Event()
+        self.last_sweep = 0.0
+        self.pushed = 0
+        self.coalesced = 0
+        self.demoted = 0
+        self.dropped = 0
+        self.sent = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def push(self, feed, key, priority, send, on_done=None):
+        """Queue ``send()`` for one alert, replacing a waiting older version of it."""
+        now = time.monotonic()
+        key = (feed,) + tuple(key)
+        old = self.pending.get(key)
+        if old is not None:
+            old.cancelled = True
+            self.coalesced += 1
+            FEED_ITEMS.labels(feed, "coalesced").inc()
+            self._done(old, None)
+        entry = self.pending[key] = PendingAlert(feed, key, priority, now, send, on_done)
+        self._push(entry, demoted=False)
+        self.pushed += 1
+        self.ready.set()
+
+    def _push(self, entry, demoted):
+        heapq.heappush(self.heap, (demoted, -entry.priority, -entry.queued_at, next(self.order), entry))
+
+    def _done(self, entry, result):
+        if entry.on_done is not None:
+            try:
+                entry.on_done(result)
+            except Exception as e:
+                print(f"Error finishing {entry.feed} alert: {e}")
+
+    def _drop(self, entry):
+        del self.pending[entry.key]
+        entry.cancelled = True
+        self.dropped += 1
+        FEED_ITEMS.labels(entry.feed, "stale").inc()
+        self._done(entry, None)
+
+    def _sweep(self, now):
+        # Demoted alerts may never reach the top under sustained load; drop them here instead.
+        for entry in [e for e in self.pending.values() if now - e.queued_at > self.drop_after]:
+            self._drop(entry)
+        self.heap = [item for item in self.heap if not item[-1].cancelled]
+        heapq.heapify(self.heap)
+        self.last_sweep = now
+
+    def pop(self):
+        """The next alert to send, or None if nothing is waiting."""
+        now = time.monotonic()
+        if now - self.last_sweep > min(60.0, self.drop_after):
+            self._sweep(now)
+        while self.heap:
+            demoted, _, _, _, entry = heapq.heappop(self.heap)
+            if entry.cancelled:
+                continue
+            age = now - entry.queued_at
+            if age > self.drop_after:
+                self._drop(entry)
+            elif not demoted and age > self.stale_after:
+                self.demoted += 1
+                FEED_ITEMS.labels(entry.feed, "demoted").inc()
+                self._push(entry, demoted=True)
+            else:
+                del self.pending[entry.key]
+                return entry
+        return None
+
+    async def get(self):
+        while True:
+            entry = self.pop()
+            if entry is not None:
+                return entry
+            self.ready.clear()
+            await self.ready.wait()
+
+    def oldest_age(self):
+        now = time.monotonic()
+        return max((now - entry.queued_at for entry in list(self.pending.values())), default=0.0)
+
+    def depth_by_feed(self):
+        depth = {}
+        for entry in list(self.pending.values()):
+            depth[entry.feed] = depth.get(entry.feed, 0) + 1
+        return depth
+
+    def stats(self):
+        return {
+            "depth": len(self.pending),
+            "oldest": round(self.oldest_age(), 1),
+            "pushed": self.pushed,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "demoted": self.demoted,
+            "dropped": self.dropped,
+        }
+
+
+alert_queue = AlertQueue()
+
+Gauge("dexmonitor_alert_queue_depth", "Rendered alerts waiting for dispatch.", ("feed",),
+      callback=lambda: {(feed,): n for feed, n in alert_queue.depth_by_feed().items()})
+Gauge("dexmonitor_alert_queue_oldest_seconds", "Age of the oldest alert waiting for dispatch.",
+      callback=alert_queue.oldest_age)
+
+
+async def _send_loop(queue):
+    while True:
+        entry = await queue.get()
+        try:
+            result = await entry.send()
+        except Exception as e:
+            print(f"Error sending {entry.feed} alert: {e}")
+            result = False
+        queue.sent += 1
+        queue._done(entry, result)
+
+
+async def run_alert_senders(queue=alert_queue, senders=ALERT_SENDERS):
+    """Send queued alerts forever, ``senders`` at a time."""
+    await asyncio.gather(*(_send_loop(queue) for _ in range(max(1, senders))))
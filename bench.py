@@ -0,0 +1,263 @@
+"""Microbenchmarks for the dedup, persistence and formatting hot paths.
+
+    python bench.py                          # 3.5k, 100k and 1M entry histories
+    python bench.py --sizes 3500 100000 --output bench.jsonl
+    python bench.py --compare old.jsonl      # print ratios against an earlier run
+
+Every result is one JSON object per line (bench, size, ops, seconds,
+ops_per_sec, peak_bytes, ...), so two runs can be diffed or compared.
+Everything runs in a temporary directory and touches no real state.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_SIZES = (3500, 100_000, 1_000_000)
+CHAINS = ("solana", "ethereum", "bsc", "base")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def random_address(rng):
+    return "".join(rng.choices(string.ascii_letters + string.digits, k=44))
+
+
+def synthetic_signatures(n, seed=1):
+    rng = random.Random(seed)
+    return [
+        {"name": f"Token {i}", "tokenAddress": random_address(rng), "symbol": f"T{i % 10000}",
+         "chainId": CHAINS[i % len(CHAINS)]}
+        for i in range(n)
+    ]
+
+
+def synthetic_feed(n, seed=2):
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    items, pairs = [], []
+    for i in range(n):
+        address = random_address(rng)
+        chain = CHAINS[i % len(CHAINS)]
+        items.append({
+            "chainId": chain, "tokenAddress": address, "url": f"https://dexscreener.com/{chain}/{address}",
+            "header": f"https://cdn.example/{address}.png", "amount": rng.randint(1, 500),
+            "totalAmount": rng.randint(500, 5000),
+            "links": [{"type": "website", "url": "https://example.org"}, {"label": "X", "url": "https://x.com/t"}],
+            # Fields the bot never reads, as in the real payloads.
+            "icon": f"https://cdn.example/{address}-icon.png", "description": "x" * rng.randint(50, 400),
+        })
+        pairs.append({
+            "chainId": chain,
+            "baseToken": {"address": address, "name": f"Token {i}", "symbol": f"T{i}"},
+            "volume": {"h24": rng.random() * 1e7}, "liquidity": {"usd": rng.random() * 1e6},
+            "priceChange": {"h24": rng.uniform(-90, 400)}, "marketCap": rng.random() * 1e9,
+            "pairCreatedAt": now_ms - rng.randint(0, 30 * 86400 * 1000),
+            "dexId": "raydium", "pairAddress": random_address(rng), "priceUsd": str(rng.random()),
+            "txns": {w: {"buys": rng.randint(0, 999), "sells": rng.randint(0, 999)} for w in ("m5", "h1", "h6", "h24")},
+            "info": {"imageUrl": f"https://cdn.example/{address}.png", "websites": [{"url": "https://example.org"}]},
+        })
+    return items, pairs
+
+
+def measure(fn, ops, repeat=3):
+    """Best-of-``repeat`` wall time for ``fn()``, which performs ``ops`` operations."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return {"ops": ops, "seconds": best, "ops_per_sec": ops / best if best else None}
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+# Reference copies of the original list-based helpers, to show what the index replaced.
+def legacy_is_sent(signature, sent):
+    for entry in sent:
+        if entry["tokenAddress"] == signature["tokenAddress"] and entry["chainId"] == signature["chainId"]:
+            return entry == signature
+    return False
+
+
+def legacy_replace_or_add(signature, existing):
+    for i, entry in enumerate(existing):
+        if entry["tokenAddress"] == signature["tokenAddress"] and entry["chainId"] == signature["chainId"]:
+            if entry != signature:
+                existing[i] = signature
+            return existing
+    existing.append(signature)
+    return existing
+
+
+def bench_dedup(size, emit, legacy):
+    from funct import DedupIndex
+
+    signatures = synthetic_signatures(size)
+    index, peak = peak_memory(lambda: DedupIndex(signatures, max_size=size, ttl=0))
+    emit("index_build", size, peak_bytes=peak, **measure(lambda: DedupIndex(signatures, max_size=size, ttl=0), size, 1))
+
+    probes = random.Random(3).sample(signatures, min(10_000, size))
+    misses = synthetic_signatures(len(probes), seed=4)
+    emit("lookup_hit", size, **measure(lambda: [index.is_sent(s) for s in probes], len(probes)))
+    emit("lookup_miss", size, **measure(lambda: [index.is_sent(s) for s in misses], len(misses)))
+
+    updates = [dict(s, name=s["name"] + "!") for s in probes[:5000]]
+    emit("upsert", size, **measure(lambda: [index.upsert(s) for s in updates + misses[:5000]],
+                                   len(updates) + min(5000, len(misses)), 1))
+
+    if legacy:
+        few = probes[:200]
+        emit("legacy_lookup", size, **measure(lambda: [legacy_is_sent(s, signatures) for s in few], len(few), 1))
+        copy = list(signatures)
+        emit("legacy_upsert", size, **measure(lambda: [legacy_replace_or_add(s, copy) for s in misses[:50]], 50, 1))
+
+
+def bench_seen_set(size, emit):
+    from seenset import SeenSet, file_size
+
+    signatures = synthetic_signatures(size)
+
+    def build(path=None):
+        seen = SeenSet(path, capacity=int(size / 0.7) + 1)
+        for s in signatures:
+            seen.upsert(s)
+        return seen
+
+    seen, peak = peak_memory(build)
+    emit("seen_build", size, peak_bytes=peak, table_bytes=file_size(seen.capacity), **measure(build, size, 1))
+
+    probes = random.Random(3).sample(signatures, min(10_000, size))
+    misses = synthetic_signatures(len(probes), seed=4)
+    emit("seen_lookup_hit", size, **measure(lambda: [seen.is_sent(s) for s in probes], len(probes)))
+    emit("seen_lookup_miss", size, **measure(lambda: [seen.is_sent(s) for s in misses], len(misses)))
+
+    build(f"seen_{size}.bin").close()
+    emit("seen_open", size, **measure(lambda: SeenSet(f"seen_{size}.bin").close(), 1))
+
+
+def bench_storage(size, emit):
+    from funct import DedupIndex, SENT_FILES, CHAT_FILE
+    from storage import JsonStorage, SqliteStorage
+
+    signatures = synthetic_signatures(size)
+    new = synthetic_signatures(30, seed=5)
+    index = DedupIndex(signatures, max_size=size + len(new), ttl=0)
+    for s in new:
+        index.upsert(s)
+
+    json_store = JsonStorage(SENT_FILES, CHAT_FILE)
+    json_store.save_signatures("tokens", signatures, signatures)
+
+    def json_cycle():
+        json_store.load_signatures("tokens")
+        json_store.save_signatures("tokens", new, index.signatures())
+
+    _, peak = peak_memory(json_cycle)
+    emit("json_load_save", size, peak_bytes=peak, **measure(json_cycle, 1, 1))
+
+    sqlite_store = SqliteStorage(f"bench_{size}.db", max_size=size + len(new))
+    sqlite_store.save_signatures("tokens", signatures)
+    emit("sqlite_load", size, **measure(lambda: sqlite_store.load_signatures("tokens"), 1, 1))
+    emit("sqlite_save_cycle", size, **measure(lambda: sqlite_store.save_signatures("tokens", new), 1))
+    sqlite_store.close()
+
+
+def bench_formatting(emit):
+    from funct import token_age, value_number
+    from pipeline import make_record, make_signature, render
+    from records import decode_feed, decode_pairs
+    from check import FEEDS
+
+    raw_items, raw_pairs = synthetic_feed(1000)
+    feed_body, pairs_body = json.dumps(raw_items).encode(), json.dumps({"pairs": raw_pairs}).encode()
+    emit("decode_feed", len(raw_items), **measure(lambda: decode_feed(feed_body), len(raw_items)))
+    emit("decode_pairs", len(raw_pairs), **measure(lambda: decode_pairs(pairs_body), len(raw_pairs)))
+    items, pairs = decode_feed(feed_body), decode_pairs(pairs_body)
+    values = [p.marketCap for p in pairs]
+    stamps = [p.pairCreatedAt for p in pairs]
+    emit("value_number", len(values), **measure(lambda: [value_number(v) for v in values], len(values)))
+    emit("token_age", len(stamps), **measure(lambda: [token_age(t) for t in stamps], len(stamps)))
+    emit("make_record", len(items), **measure(lambda: [make_record(i, p) for i, p in zip(items, pairs)], len(items)))
+
+    records = [make_record(i, p) for i, p in zip(items, pairs)]
+    for name, feed in FEEDS.items():
+        emit(f"render_{name}", len(records),
+             **measure(lambda: [(make_signature(feed, r), render(feed, r)) for r in records], len(records)))
+
+
+def compare(path, results):
+    with open(path) as f:
+        old = {(r["bench"], r["size"]): r for r in map(json.loads, f) if "bench" in r}
+    print(f"{'bench':<22}{'size':>10}{'old ops/s':>14}{'new ops/s':>14}{'ratio':>8}", file=sys.stderr)
+    for r in results:
+        before = old.get((r["bench"], r["size"]))
+        if before and before.get("ops_per_sec") and r.get("ops_per_sec"):
+            ratio = r["ops_per_sec"] / before["ops_per_sec"]
+            flag = "  <-- slower" if ratio < 0.9 else ""
+            print(f"{r['bench']:<22}{r['size']:>10}{before['ops_per_sec']:>14.0f}{r['ops_per_sec']:>14.0f}"
+                  f"{ratio:>8.2f}{flag}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--output", help="append results to this file as JSON lines (default: stdout)")
+    parser.add_argument("--compare", help="earlier JSON-lines output to compare against")
+    parser.add_argument("--no-legacy", action="store_true", help="skip the slow list-scan reference runs")
+    parser.add_argument("--skip-storage", action="store_true")
+    args = parser.parse_args()
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo)
+    meta = {"revision": git_revision(), "python": platform.python_version(), "time": time.time()}
+    results = []
+    out = open(args.output, "a") if args.output else sys.stdout
+
+    def emit(bench, size, **fields):
+        result = {"bench": bench, "size": size, **fields, **meta}
+        results.append(result)
+        out.write(json.dumps(result) + "\n")
+        out.flush()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # funct/check open their state files relative to the working directory.
+        os.chdir(tmp)
+        bench_formatting(emit)
+        for size in args.sizes:
+            bench_dedup(size, emit, legacy=not args.no_legacy)
+            bench_seen_set(size, emit)
+            if not args.skip_storage:
+                bench_storage(size, emit)
+        os.chdir(repo)
+
+    if args.output:
+        out.close()
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
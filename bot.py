@@ -1,48 +1,74 @@
 import os
 import asyncio
+import time
 from telegram import Update
-from flask import Flask
-from threading import Thread
 from telegram.ext import Application, MessageHandler, filters, CommandHandler, ContextTypes
 # from checker import get_latest_boost, get_latest_tokens, register, get_trending
-from check import get_latest_tokens, get_latest_boost, get_trending, register
+from alert_queue import alert_queue, run_alert_senders
+from botpool import bot_pool, open_bot_pool
+from check import (FEEDS, pollers, register, registry, run_feed_loop, run_registry_refresh_loop, set_filter,
+                   subscription_index)
+from cluster import (BOT_ROLE, CLUSTER_POLL_INTERVAL, WORKER_HTTP_PORT, open_cluster, run_membership_loop,
+                     run_with_lease)
+from http_client import close_client
+from enrich import pair_cache
+from media import media_cache
+from dispatch import dispatcher, TELEGRAM_GLOBAL_RATE
+from funct import reset_indexes, storage
+from outbox import outbox, run_outbox_loop
+import upstream
+from server import build_server, WEBHOOK_PATH, WEBHOOK_SECRET
+from storage import SqliteStorage
 from dotenv import load_dotenv
 
 
 load_dotenv()
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
-
-flask_app = Flask(__name__)
-
-@flask_app.route("/")
-def home():
-    return "✅ Telegram bot is running!", 200
-
-def run_flask():
-    flask_app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
-
-def start_flask():
-    thread = Thread(target=run_flask)
-    thread.daemon = True
-    thread.start()
+STATS_INTERVAL = float(os.environ.get("STATS_INTERVAL", 60))
+# "webhook" receives updates on WEBHOOK_URL + WEBHOOK_PATH; "polling" is the long-polling fallback.
+BOT_MODE = os.environ.get("BOT_MODE", "webhook" if os.environ.get("WEBHOOK_URL") else "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "").rstrip("/")
+# Longest wait before restarting a background task that keeps failing.
+TASK_MAX_BACKOFF = float(os.environ.get("TASK_MAX_BACKOFF", 60))
 
 
 
 async def bot():
     app = Application.builder().token(BOT_TOKEN).concurrent_updates(256).build()
     # app.add_handler(CommandHandler("register", register))
+    app.add_handler(CommandHandler("filter", set_filter, filters.ChatType.CHANNEL))
     app.add_handler(MessageHandler(filters.ChatType.CHANNEL & ~filters.COMMAND, register))
     # app.add_handler(MessageHandler(filters.ALL, handle_forward))
-    start_flask()
 
-    token_checker = asyncio.create_task(run_token_checker(app))
+    webhook = BOT_MODE == "webhook"
+    if webhook and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        print("⚠️ Webhook mode needs WEBHOOK_URL and WEBHOOK_SECRET, falling back to polling")
+        webhook = False
+
+    cluster = None
+    if BOT_ROLE != "standalone":
+        if BOT_ROLE not in ("coordinator", "worker") or not isinstance(storage, SqliteStorage):
+            print(f"❌ BOT_ROLE={BOT_ROLE} needs STORAGE_BACKEND=sqlite shared by every process")
+            return
+        cluster = open_cluster(storage)
+
+    accepting = (lambda: "coordinator" in cluster.leases) if BOT_ROLE == "coordinator" else None
+    if BOT_ROLE != "worker":
+        server = build_server(app, webhook=webhook, accepting=accepting)
+    elif WORKER_HTTP_PORT:
+        server = build_server(app, port=int(WORKER_HTTP_PORT))
+    else:
+        # Several workers per host would otherwise all fight over PORT.
+        server = None
     async with app:
+        await open_bot_pool(app.bot)
+        if server is not None:
+            await server.start()
         await app.start()
-        await app.updater.start_polling()
-        print("Bot is pooling...")
+        print(f"Bot is running as {BOT_ROLE}" + (f" ({cluster.worker_id})" if cluster else ""))
 
-        await asyncio.Event().wait()
+        token_checker = asyncio.create_task(run_token_checker(app, webhook, cluster))
         try:
             await asyncio.Event().wait()
         finally:
@@ -51,23 +77,118 @@ async def bot():
                 await token_checker
             except asyncio.CancelledError:
                 pass
+            await registry.flush()
+            if cluster is not None:
+                await cluster.leave()
+            await app.stop()
+            await bot_pool.shutdown()
+            if server is not None:
+                await server.stop()
+            await close_client()
+
+
+async def receive_updates(app, webhook):
+    """Take updates from Telegram until cancelled."""
+    if webhook:
+        await app.bot.set_webhook(
+            url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        print(f"Bot is receiving updates on {WEBHOOK_URL}{WEBHOOK_PATH}")
+    else:
+        await app.updater.start_polling()
+        print("Bot is pooling...")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        if app.updater.running:
+            await app.updater.stop()
 
 
-async def run_token_checker(app):
+async def supervise(name, start, max_backoff=TASK_MAX_BACKOFF):
+    """Run ``start()`` until cancelled, restarting it with a growing delay whenever it fails or returns."""
+    delay = 1.0
+    while True:
+        started = time.monotonic()
+        try:
+            await start()
+            problem = "stopped"
+        except Exception as e:
+            problem = f"crashed ({type(e).__name__}: {e})"
+        if time.monotonic() - started > max_backoff:
+            # It ran for a while before failing: start over from the shortest delay.
+            delay = 1.0
+        print(f"❌ {name} {problem}, restarting in {delay:.0f}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_backoff)
+
+
+def feed_tasks():
+    return {f"{name} feed": lambda name=name: run_feed_loop(name, bot_pool) for name in FEEDS}
+
+
+def coordinator_tasks(app, webhook):
+    # Another coordinator may have registered chats and sent alerts since we last held the lease.
+    reset_indexes()
+    tasks = {
+        "registry refresh": run_registry_refresh_loop,
+        "updates": lambda: receive_updates(app, webhook),
+        **feed_tasks(),
+        "alert senders": run_alert_senders,
+        "outbox": lambda: run_outbox_loop(bot_pool, deliver=False),
+    }
+    return [supervise(name, start) for name, start in tasks.items()]
+
+
+def share_global_rate(cluster):
+    # Every worker sends with the same bot tokens, so they split each bot's global limit.
+    bot_pool.set_global_rate(TELEGRAM_GLOBAL_RATE / max(1, len(cluster.ring.members)))
+
+
+async def run_token_checker(app, webhook=False, cluster=None):
+    # Each task is supervised: one that crashes is logged and restarted instead of
+    # leaving the bot up with that part silently gone.
+    if BOT_ROLE == "coordinator":
+        outbox.inline = False
+        tasks = {"coordinator lease": lambda: run_with_lease(cluster, "coordinator",
+                                                             lambda: coordinator_tasks(app, webhook))}
+    elif BOT_ROLE == "worker":
+        outbox.owns = cluster.owns
+        tasks = {
+            "membership": lambda: run_membership_loop(cluster, share_global_rate),
+            "outbox": lambda: run_outbox_loop(bot_pool, CLUSTER_POLL_INTERVAL, prune=False),
+        }
+    else:
+        tasks = {
+            "updates": lambda: receive_updates(app, webhook),
+            **feed_tasks(),
+            "alert senders": run_alert_senders,
+            "outbox": lambda: run_outbox_loop(bot_pool),
+        }
+    tasks["stats"] = lambda: report_stats(cluster)
+    await asyncio.gather(*(supervise(name, start) for name, start in tasks.items()))
+
+
+async def report_stats(cluster=None):
     while True:
+        await asyncio.sleep(STATS_INTERVAL)
         try:
-            from telegram.ext import CallbackContext
-            from telegram import Update
-            context = CallbackContext(app)
-            update = Update(app)
-            await get_latest_tokens(update, context)
-            await asyncio.sleep(15)
-            await get_latest_boost(context)
-            await asyncio.sleep(15)
-            await get_trending(update, context)
+            if cluster is not None:
+                print(f"Cluster: {cluster.stats()}")
+            print(f"Registry: {registry.stats()}")
+            print(f"Subscriptions: {subscription_index.stats()}")
+            print(f"Pair cache: {pair_cache.stats()}")
+            print(f"Upstream: {upstream.stats()}")
+            print(f"Media cache: {media_cache.stats()}")
+            print(f"Alert queue: {alert_queue.stats()}")
+            print(f"Dispatcher: {dispatcher.stats()}")
+            print(f"Bot pool: {bot_pool.stats()}")
+            print(f"Outbox: {outbox.stats()} queued={await outbox.depth()}")
+            for name, poller in pollers.items():
+                print(f"Feed {name}: {poller.stats()}")
         except Exception as e:
-            print(f"Error in checker: {e}")
-        await asyncio.sleep(60) 
+            print(f"Error reporting stats: {e}")
 
 
 
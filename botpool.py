@@ -0,0 +1,206 @@
+import asyncio
+import os
+import time
+
+from dotenv import load_dotenv
+from telegram import Bot
+from telegram.error import InvalidToken, RetryAfter
+
+from cluster import HashRing
+from dispatch import Dispatcher, dispatcher, retry_after_seconds
+from metrics import BOT_SENDS, Gauge, SEND_FAILURES
+from registry import is_dead_chat_error
+
+
+load_dotenv()
+
+# Extra send-only bot tokens, comma-separated. Each must be an admin of the channels it
+# gets; BOT_TOKEN keeps receiving updates and is part of the pool as well.
+BOT_TOKENS = os.environ.get("BOT_TOKENS", "")
+# A bot told to wait longer than this hands its sends to the next bot instead.
+BOT_FAILOVER_AFTER = float(os.environ.get("BOT_FAILOVER_AFTER", 5))
+
+
+class NoBotAvailable(Exception):
+    """Every bot of the pool is revoked."""
+
+
+def bot_name(bot):
+    # The numeric bot ID before the colon; the rest of the token is the secret.
+    return bot.token.split(":", 1)[0]
+
+
+class PoolBot:
+    """One bot of the pool with its own rate limits and health."""
+
+    def __init__(self, bot, dispatcher):
+        self.bot = bot
+        self.name = bot_name(bot)
+        self.dispatcher = dispatcher
+        self.limited_until = 0.0
+        self.revoked = False
+        self.sent = 0
+        self.failovers = 0
+
+    def state(self, now=None):
+        if self.revoked:
+            return "revoked"
+        if (time.monotonic() if now is None else now) < self.limited_until:
+            return "limited"
+        return "healthy"
+
+
+class BotPool:
+    """Several bots sharing the sends, each chat sticking to one of them.
+
+    Chats are spread over the bots by consistent hashing, so adding or losing
+    a bot only moves the chats next to it. A bot that is rate-limited for
+    longer than BOT_FAILOVER_AFTER, or whose token was revoked, is skipped
+    and its chats go to the next bot on the ring. A bot that cannot post in
+    a chat (not an admin there) passes it on too; the chat is pinned to the
+    bot that could, and only counts as gone once every bot has failed it.
+    """
+
+    def __init__(self):
+        self.members = {}
+        self.ring = HashRing()
+        self.pins = {}
+        self.owned = []
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, bot, dispatcher=None):
+        member = PoolBot(bot, dispatcher or Dispatcher())
+        self.members[member.name] = member
+        self.ring = HashRing(self.members)
+        if len(self.members) > 1:
+            for other in self.members.values():
+                other.dispatcher.max_retry_after = BOT_FAILOVER_AFTER
+        return member
+
+    async def add_tokens(self, tokens):
+        """Start a send-only bot per token; tokens Telegram rejects are skipped."""
+        for token in tokens:
+            bot = Bot(token)
+            try:
+                await bot.initialize()
+            except InvalidToken as e:
+                print(f"❌ Skipping pool bot {bot_name(bot)}: {e}")
+                continue
+            self.owned.append(bot)
+            self.add(bot)
+        print(f"🤖 Sending with {len(self.members)} bot(s): {', '.join(self.members)}")
+
+    async def shutdown(self):
+        for bot in self.owned:
+            await bot.shutdown()
+        self.owned = []
+
+    def set_global_rate(self, rate):
+        for member in self.members.values():
+            member.dispatcher.set_global_rate(rate)
+
+    def pick(self, chat_id, tried=()):
+        """The bot to send to this chat with, or None if every bot was tried or revoked."""
+        now = time.monotonic()
+        pinned = self.members.get(self.pins.get(chat_id))
+        if pinned is not None and pinned.name not in tried and pinned.state(now) == "healthy":
+            return pinned
+        owner = self.members.get(self.ring.owner(chat_id))
+        if owner is not None and owner.name not in tried and owner.state(now) == "healthy":
+            return owner
+        candidates = [self.members[name] for name in self.ring.successors(chat_id) if name not in tried]
+        for member in candidates:
+            if member.state(now) == "healthy":
+                return member
+        # Nothing healthy left: wait for whichever limited bot frees up first.
+        candidates = [member for member in candidates if not member.revoked]
+        return min(candidates, key=lambda member: member.limited_until, default=None)
+
+    async def send(self, chat_id, send):
+        """Run ``send(bot, chat_id)`` with the chat's bot, failing over to the others."""
+        tried = set()
+        error = None
+        pin = False
+        last = None
+        while True:
+            member = self.pick(chat_id, tried)
+            if member is None:
+                if last is not None:
+                    BOT_SENDS.labels(last.name, "failed").inc()
+                raise error or NoBotAvailable("no usable bot left in the pool")
+            tried.add(member.name)
+            last = member
+            wait = member.limited_until - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                result = await member.dispatcher.send(chat_id, lambda target: send(member.bot, target))
+            except InvalidToken as e:
+                member.revoked = True
+                print(f"❌ Bot {member.name} was revoked: {e}")
+                error = e
+            except RetryAfter as e:
+                member.limited_until = time.monotonic() + retry_after_seconds(e)
+                error = e
+            except Exception as e:
+                if len(self.members) == 1 or not is_dead_chat_error(e):
+                    BOT_SENDS.labels(member.name, "failed").inc()
+                    raise
+                # This bot may just not be an admin there; another one may be.
+                self.pins.pop(chat_id, None)
+                pin = True
+                error = e
+            else:
+                member.sent += 1
+                BOT_SENDS.labels(member.name, "sent").inc()
+                if pin:
+                    self.pins[chat_id] = member.name
+                return result
+            member.failovers += 1
+            BOT_SENDS.labels(member.name, "failover").inc()
+
+    async def fan_out(self, chat_ids, send):
+        """Send to every chat concurrently; returns {chat_id: result or exception}."""
+        chat_ids = list(chat_ids)
+        results = await asyncio.gather(*(self.send(chat_id, send) for chat_id in chat_ids), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                SEND_FAILURES.labels(type(result).__name__).inc()
+        return dict(zip(chat_ids, results))
+
+    def stats(self):
+        now = time.monotonic()
+        bots = {
+            name: {
+                "state": member.state(now),
+                "sent": member.sent,
+                "failovers": member.failovers,
+                "rate": round(member.dispatcher.global_bucket.rate, 1),
+            }
+            for name, member in self.members.items()
+        }
+        return {"bots": bots, "pinned": len(self.pins)}
+
+
+bot_pool = BotPool()
+
+
+def parse_tokens(spec=BOT_TOKENS):
+    return [token.strip() for token in spec.split(",") if token.strip()]
+
+
+async def open_bot_pool(primary):
+    """Fill the pool with the application's bot (sharing the global dispatcher) and BOT_TOKENS."""
+    bot_pool.add(primary, dispatcher)
+    await bot_pool.add_tokens(token for token in parse_tokens() if token != primary.token)
+    return bot_pool
+
+
+BOT_STATES = {"healthy": 0, "limited": 1, "revoked": 2}
+
+Gauge("dexmonitor_bot_state", "Health of each pool bot (0 healthy, 1 rate-limited, 2 revoked).", ("bot",),
+      callback=lambda: {(name,): BOT_STATES[m.state()] for name, m in list(bot_pool.members.items())})
+Gauge("dexmonitor_bot_send_rate", "Current adaptive send rate of each pool bot (messages/s).", ("bot",),
+      callback=lambda: {(name,): m.dispatcher.global_bucket.rate for name, m in list(bot_pool.members.items())})
@@ -1,17 +1,18 @@
 import asyncio
 import os
-import requests
 from telegram import Update
-from telegram.constants import ParseMode
-from telegram.ext import CallbackContext, ContextTypes
-from io import BytesIO
-
-from funct import (
-    load_sent_file, save_sent_file, make_token_signature, is_token_already_sent,
-    load_boosted_tokens, save_boosted_tokens, make_boost_signature, is_boost_already_sent,
-    load_trending_tokens, save_trending_tokens, make_trending_signature, is_trend_already_sent,
-    token_age, value_number, load_registered_chats, save_registered_chats
-)
+from telegram.ext import ContextTypes
+
+from alert_queue import alert_queue
+from funct import load_registered_chats, load_subscriptions, save_subscription
+from outbox import outbox
+from pipeline import FILTERED, run_feed
+from profiling import cycle_profiler
+from metrics import Gauge
+from registry import REGISTRY_REFRESH_INTERVAL, ChatRegistry
+from scheduler import FeedPoller, UpstreamBusy
+from upstream import CircuitOpen
+from subscriptions import SubscriptionIndex, describe_settings, parse_settings
 
 from dotenv import load_dotenv
 
@@ -19,280 +20,180 @@ from dotenv import load_dotenv
 load_dotenv()
 
 LATEST_TOKEN_PROFILES = os.environ.get("LATEST_TOKEN_PROFILES")
-TOKEN_PROFILE_NAMES = os.environ.get("TOKEN_PROFILE_NAMES")
 LATEST_BOOST = os.environ.get("LATEST_BOOST")
 TRENDING_TOKENS = os.environ.get("TRENDING_TOKENS")
-registered_groups = load_registered_chats()
-
-
+registry = ChatRegistry(load_registered_chats())
+
+Gauge("dexmonitor_registered_chats", "Channels registered for alerts.", callback=lambda: len(registry))
+
+
+# Every feed runs through the same pipeline. A feed needs its source URL, the
+# sent-history it dedups against ("kind"), the record fields that make up its
+# signature and a caption template over the fields built by pipeline.make_record.
+# Optional "interval", "min_interval" and "max_interval" override the poll timing.
+# "priority" orders alerts waiting for dispatch across feeds (higher goes first).
+# "unknown" is the (name, symbol) used when the pair has none; it is part of sent
+# signatures, so each feed keeps the placeholder it always had.
+# "kind" defaults to the feed's name and its JSON history to sent_<kind>.json. Feeds
+# sharing a kind share that history; queue entries, outbox rows and metrics go by feed name.
+FEEDS = {
+    "tokens": {
+        "url": LATEST_TOKEN_PROFILES,
+        "kind": "tokens",
+        "label": "Token",
+        "priority": 2,
+        "signature": ("name", "tokenAddress", "symbol", "chainId"),
+        "template": (
+            "🚨 <b>Token Alert!</b>\n\n"
+            "🔵 <b>{name} [{symbol}] [{chainId}]</b>\n\n"
+            "<code>{tokenAddress}</code>\n\n"
+            "🌱Age: {age} | 💰MC: <code>${main_cap}</code>\n"
+            "💧Liq: <code>${main_liq}</code> | 📈24h: <code>{priceChange}%</code>\n"
+            "🔊Vol: <code>${main_vol}</code>\n\n"
+            "📊<a href='{url}'>Chart</a>\n"
+            "🔗 <b>{links_text}</b>"
+        ),
+    },
+    "boosts": {
+        "url": LATEST_BOOST,
+        "kind": "boosts",
+        "label": "boost",
+        "priority": 1,
+        "unknown": ("Unknown Name", "Unknown Symbol"),
+        "signature": ("name", "tokenAddress", "chainId", "amount", "totalAmount"),
+        "template": (
+            "⚡️ <b>{amount} Token Boosts!</b>\n\n"
+            "🔵 <b>{name} [{symbol}] [{chainId}]</b>\n\n"
+            "<code>{tokenAddress}</code>\n\n"
+            "<b>Total Boosts</b>: {totalAmount}\n\n"
+            "🌱Age: {age} | 💰MC: <code>${main_cap}</code>\n"
+            "💧 Liq: <code>${main_liq}</code> | 📈24h: <code>{priceChange}%</code>\n"
+            "🔊Vol: <code>${main_vol}</code>\n\n"
+            "📊<a href='{url}'>Chart</a>\n"
+            "🔗 <b>{links_text}</b>"
+        ),
+    },
+    "trends": {
+        "url": TRENDING_TOKENS,
+        "kind": "trends",
+        "label": "trend",
+        "priority": 3,
+        "unknown": ("Unknown Name", "Unknown Symbol"),
+        "signature": ("name", "tokenAddress", "symbol", "chainId"),
+        "template": (
+            "🚨 <b>Trending</b>\n\n"
+            "🔵 <b>{name} [{symbol}] [{chainId}]</b>\n\n"
+            "<code>{tokenAddress}</code>\n\n"
+            "🌱Age: {age} | 💰MC: <code>${main_cap}</code>\n"
+            "💧 Liq: <code>${main_liq}</code> | 📈24h: <code>{priceChange}%</code>\n"
+            "🔊Vol: <code>${main_vol}</code>\n\n"
+            "📊<a href='{url}'>Chart</a>\n"
+            "🔗 <b>{links_text}</b>"
+        ),
+    },
+}
+
+for _name, _feed in FEEDS.items():
+    _feed.setdefault("name", _name)
+    _feed.setdefault("kind", _name)
+
+subscription_index = SubscriptionIndex(registry, load_subscriptions(), FEEDS)
+registry.listeners.append(subscription_index.invalidate)
+
+outbox.on_dead_chat = registry.evict
+
+
+async def register_channel(bot, channel_id):
+    """Register a channel if it is new: confirm it there and backfill its recent alerts."""
+    if registry.add(channel_id):
+        await bot.send_message(chat_id=channel_id, text="✅ Registered this channel for token alerts.")
+        await outbox.backfill(channel_id)
 
 
 async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Runs for every post in every channel the bot is in: only a new channel costs a reply.
     if update.channel_post:
-        channel_chat = update.channel_post.chat
-        channel_id = channel_chat.id
-        if channel_id not in registered_groups:
-            registered_groups.add(channel_id)
-            save_registered_chats(registered_groups)
-            await context.bot.send_message(chat_id=channel_id, text="✅ Registered this channel for token alerts.")
-        else:
-            await context.bot.send_message(chat_id=channel_id, text="ℹ️ This Channel is already registered.")
-
-
-
-async def get_latest_tokens(update: Update, context: CallbackContext):
-    response = requests.get(LATEST_TOKEN_PROFILES)
-    tokens = tokens = response.json()
-
-    sent_tokens = await load_sent_file()
-    new_tokens = []
-
-
-    for tok in tokens:
-        token_address = tok.get("tokenAddress", "Unknown")
-        chain_id = tok.get("chainId", "Unknown")
-        chart = tok.get("url", "Unknown")
-        header = tok.get("header", "Unknown")
-
-        # Defaults
-        name = symbol = main_vol = main_liq = main_cap = age = "N/A"
-        volume_24h = liquidity_usd = market_cap = created_at = "N/A"
-
+        await register_channel(context.bot, update.channel_post.chat.id)
+
+
+async def set_filter(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/filter in a channel: show, set ("/filter chains=solana min_liq=10k") or reset its alert filters."""
+    if not update.channel_post:
+        return
+    channel_id = update.channel_post.chat.id
+    args = context.args or []
+    if not args:
+        text = f"🔧 Filters: {describe_settings(subscription_index.get(channel_id))}"
+        await context.bot.send_message(chat_id=channel_id, text=text)
+        return
+    try:
+        settings = {} if args == ["reset"] else parse_settings(args, FEEDS)
+    except ValueError as e:
+        await context.bot.send_message(chat_id=channel_id, text=f"⚠️ {e}")
+        return
+
+    subscription_index.set(channel_id, settings)
+    await save_subscription(channel_id, settings)
+    await register_channel(context.bot, channel_id)
+    await context.bot.send_message(chat_id=channel_id, text=f"🔧 Filters: {describe_settings(settings)}")
+
+
+async def refresh_registry():
+    """Re-read chats and filters written by other processes."""
+    await registry.refresh()
+    subscription_index.settings = await asyncio.to_thread(load_subscriptions)
+    subscription_index.invalidate()
+
+
+async def run_registry_refresh_loop(interval=REGISTRY_REFRESH_INTERVAL):
+    while True:
         try:
-            name_resp = requests.get(f"{TOKEN_PROFILE_NAMES}/{token_address}")
-            if name_resp.status_code == 200:
-                name_data = name_resp.json()
-                pairs = name_data.get("pairs", [])
-                if pairs:
-                    pair = pairs[0]
-                    base_token = pair.get("baseToken", {})
-                    name = base_token.get("name", "Unknown")
-                    symbol = base_token.get("symbol", "Unknown")
-                    volume_24h = pair.get("volume", {}).get("h24", 0)
-                    main_vol = value_number(volume_24h)
-                    liquidity_usd = pair.get("liquidity", {}).get("usd", 0)
-                    price_change = pair.get("priceChange", {}).get("h24", 0)
-                    main_liq = value_number(liquidity_usd)
-                    market_cap = pair.get("marketCap", 0)
-                    main_cap = value_number(market_cap)
-                    created_at = pair.get("pairCreatedAt", 0)
-                    age = token_age(created_at)
+            await refresh_registry()
         except Exception as e:
-            print(f"Error processing token {token_address}: {e}")
-
-        signature = make_token_signature(name, token_address, symbol, chain_id)
+            print(f"Error refreshing registered chats: {e}")
+        await asyncio.sleep(interval)
 
-        if is_token_already_sent(signature, sent_tokens):
-            print(f"⏭️ Already sent Token: {name} [{token_address}]")
-            continue
 
-        links = tok.get("links", [])
-        if links:
-            link_lines = []
-            for link in links:
-                label = link.get("label") or link.get("type", "Unknown").capitalize()
-                url = link.get("url", "No URL")
-                link_lines.append(f"<a href='{url}'>{label}</a>")
-            links_text = " | ".join(link_lines)
-        else:
-            links_text = "None"
+pollers = {}
 
-        message = (
-            f"🚨 <b>Token Alert!</b>\n\n"
-            f"🔵 <b>{name} [{symbol}] [{chain_id}]</b>\n\n"
-            f"<code>{token_address}</code>\n\n"
-            f"🌱Age: {age} | 💰MC: <code>${main_cap}</code>\n"
-            f"💧Liq: <code>${main_liq}</code> | 📈24h: <code>{price_change}%</code>\n"
-            f"🔊Vol: <code>${main_vol}</code>\n\n"
-            f"📊<a href='{chart}'>Chart</a>\n"
-            f"🔗 <b>{links_text}</b>"
-        )
-        if header != "Unknown":
-            for chat_id in registered_groups:
-                try:
-                    image_response = requests.get(header)
-                    image_bytes = BytesIO(image_response.content)
-                    image_bytes.name = "token_header.png"
-                    await context.bot.send_photo(chat_id=chat_id, photo=image_bytes, caption=message, parse_mode=ParseMode.HTML)
-                    new_tokens.append(signature)
-                    await asyncio.sleep(4)
-                except Exception as e:
-                    print(f"Error sending to {chat_id}: {e}")
-            else:
-                continue
 
-    if new_tokens:
-        save_sent_file(new_tokens)
+def get_poller(name):
+    poller = pollers.get(name)
+    if poller is None:
+        feed = FEEDS[name]
+        timing = {key: feed[key] for key in ("interval", "min_interval", "max_interval") if key in feed}
+        poller = pollers[name] = FeedPoller(name, feed["url"], **timing)
+    return poller
 
 
+async def check_feed(name, bots):
+    async def send(record, signature, message):
+        chat_ids = subscription_index.match(name, record)
+        if not chat_ids:
+            # Filtered out everywhere is not a send, so it is not saved as one; with no chats
+            # registered at all it stays pending as before.
+            return FILTERED if registry else False
+        return await outbox.send_alert(bots, name, record, signature, message, chat_ids)
 
-async def get_latest_boost(context: CallbackContext):
-    boosts = requests.get(LATEST_BOOST).json()
-    sent_boosts = await load_boosted_tokens()
-    new_boosts = []
+    return await run_feed(FEEDS[name], get_poller(name), send, alert_queue)
 
-    for tok in boosts:
-        token_address = tok.get("tokenAddress", "Unknown")
-        chain_id = tok.get("chainId", "Unknown")
-        chart = tok.get("url", "Unknown")
-        header = tok.get("header", "Unknown")
-        total_boosts = tok.get("totalAmount", 0)
-        recent_boosts = tok.get("amount", 0)
 
-        name = symbol = main_vol = main_liq = main_cap = age = "N/A"
-        volume_24h = liquidity_usd = market_cap = created_at = "N/A"
-        
+async def run_feed_loop(name, bots):
+    """Poll one feed forever on its own adaptive interval; each feed runs as its own task."""
+    poller = get_poller(name)
+    while True:
         try:
-            name_resp = requests.get(f"{TOKEN_PROFILE_NAMES}/{token_address}")
-            if name_resp.status_code == 200:
-                name_data = name_resp.json()
-                pairs = name_data.get("pairs", [])
-                if pairs:
-                    pair = pairs[0]
-                    base_token = pair.get("baseToken", {})
-                    name = base_token.get("name", "Unknown Name")
-                    symbol = base_token.get("symbol", "Unknown Symbol")
-                    volume_24h = pair.get("volume", {}).get("h24", 0)
-                    main_vol = value_number(volume_24h)
-                    liquidity_usd = pair.get("liquidity", {}).get("usd", 0)
-                    price_change = pair.get("priceChange", {}).get("h24", 0)
-                    main_liq = value_number(liquidity_usd)
-                    market_cap = pair.get("marketCap", 0)
-                    main_cap = value_number(market_cap)
-                    created_at = pair.get("pairCreatedAt", 0)
-                    age = token_age(created_at)
-        except Exception as e:
-            print(f"Error processing trending token {token_address}: {e}")
-
-        signature = make_boost_signature(name, token_address, chain_id, recent_boosts, total_boosts)
-        if is_boost_already_sent(signature, sent_boosts):
-            print(f"⏭️ Skipped already sent boost: {name} [{token_address}]")
-            continue
-
-        links = tok.get("links", [])
-        if links:
-            link_lines = []
-            for link in links:
-                label = link.get("label") or link.get("type", "Unknown").capitalize()
-                url = link.get("url", "No URL")
-                link_lines.append(f"<a href='{url}'>{label}</a>")
-            links_text = " | ".join(link_lines)
-        else:
-            links_text = "None"
-
-        message = (
-            f"⚡️ <b>{recent_boosts} Token Boosts!</b>\n\n"
-            f"🔵 <b>{name} [{symbol}] [{chain_id}]</b>\n\n"
-            f"<code>{token_address}</code>\n\n"
-            f"<b>Total Boosts</b>: {total_boosts}\n\n"
-            f"🌱Age: {age} | 💰MC: <code>${main_cap}</code>\n"
-            f"💧 Liq: <code>${main_liq}</code> | 📈24h: <code>{price_change}%</code>\n"
-            f"🔊Vol: <code>${main_vol}</code>\n\n"
-            f"📊<a href='{chart}'>Chart</a>\n"
-            f"🔗 <b>{links_text}</b>"
-        )
-
-        if header != "Unknown":
-            for chat_id in registered_groups:
-                try:
-                    image_response = requests.get(header)
-                    image_bytes = BytesIO(image_response.content)
-                    image_bytes.name = "token_header.png"
-                    await context.bot.send_photo(chat_id=chat_id, photo=image_bytes, caption=message, parse_mode=ParseMode.HTML)
-                    new_boosts.append(signature)
-                    await asyncio.sleep(4)
-                except Exception as e:
-                    print(f"Error sending to {chat_id}: {e}")
+            if cycle_profiler.watching:
+                queued = await cycle_profiler.watch(name, check_feed(name, bots))
             else:
-                continue
-
-    if new_boosts:
-        await save_boosted_tokens(new_boosts)
-
-
-
-async def get_trending(update: Update, context: CallbackContext):
-    trending = requests.get(TRENDING_TOKENS).json()
-    sent_trends = await load_trending_tokens()
-    new_trends = []
-
-
-    for tok in trending:
-        token_address = tok.get("tokenAddress", "Unknown")
-
-        chain_id = tok.get("chainId", "Unknown")
-        chart = tok.get("url", "Unknown")
-        header = tok.get("header", "Unknown")
-
-        name = symbol = main_vol = main_liq = main_cap = age = "N/A"
-        volume_24h = liquidity_usd = market_cap = created_at = "N/A"
-
-        try:
-            name_resp = requests.get(f"{TOKEN_PROFILE_NAMES}/{token_address}")
-            if name_resp.status_code == 200:
-                name_data = name_resp.json()
-                pairs = name_data.get("pairs", [])
-                if pairs:
-                    pair = pairs[0]
-                    base_token = pair.get("baseToken", {})
-                    name = base_token.get("name", "Unknown Name")
-                    symbol = base_token.get("symbol", "Unknown Symbol")
-                    volume_24h = pair.get("volume", {}).get("h24", 0)
-                    main_vol = value_number(volume_24h)
-                    liquidity_usd = pair.get("liquidity", {}).get("usd", 0)
-                    price_change = pair.get("priceChange", {}).get("h24", 0)
-                    main_liq = value_number(liquidity_usd)
-                    market_cap = pair.get("marketCap", 0)
-                    main_cap = value_number(market_cap)
-                    created_at = pair.get("pairCreatedAt", 0)
-                    age = token_age(created_at)
+                queued = await check_feed(name, bots)
+            if queued:
+                print(f"📤 {name}: queued {queued} alerts")
+            delay = poller.on_success()
+        except (UpstreamBusy, CircuitOpen) as e:
+            delay = poller.on_error(e)
+            print(f"⏳ {name} feed busy ({e}), next poll in {delay:.0f}s")
         except Exception as e:
-            print(f"Error processing trending token {token_address}: {e}")
-
-        signature = make_trending_signature(name, token_address, symbol, chain_id)
-
-        if is_trend_already_sent(signature, sent_trends):
-            print(f"⏭️ Already sent trend: {name} [{token_address}]")
-            continue
-
-        links = tok.get("links", [])
-        if links:
-            link_lines = []
-            for link in links:
-                label = link.get("label") or link.get("type", "Unknown").capitalize()
-                url = link.get("url", "No URL")
-                link_lines.append(f"<a href='{url}'>{label}</a>")
-            links_text = " | ".join(link_lines)
-        else:
-            links_text = "None"
-
-        message = (
-            f"🚨 <b>Trending</b>\n\n"
-            f"🔵 <b>{name} [{symbol}] [{chain_id}]</b>\n\n"
-            f"<code>{token_address}</code>\n\n"
-            f"🌱Age: {age} | 💰MC: <code>${main_cap}</code>\n"
-            f"💧 Liq: <code>${main_liq}</code> | 📈24h: <code>{price_change}%</code>\n"
-            f"🔊Vol: <code>${main_vol}</code>\n\n"
-            f"📊<a href='{chart}'>Chart</a>\n"
-            f"🔗 <b>{links_text}</b>"
-        )
-
-        if header != "Unknown":
-            for chat_id in registered_groups:
-                try:
-                    image_response = requests.get(header)
-                    image_bytes = BytesIO(image_response.content)
-                    image_bytes.name = "token_header.png"
-                    await context.bot.send_photo(chat_id=chat_id, photo=image_bytes, caption=message, parse_mode=ParseMode.HTML)
-                    new_trends.append(signature)
-                    await asyncio.sleep(4)
-                except Exception as e:
-                    print(f"Error sending to {chat_id}: {e}")
-            else:
-                continue
-
-    if new_trends:
-        await save_trending_tokens(new_trends)
-
-
-
+            delay = poller.on_error(e)
+            print(f"Error in {name} feed: {e}")
+        await asyncio.sleep(delay)
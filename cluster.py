@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import os
+import socket
+import time
+from bisect import bisect
+
+from dotenv import load_dotenv
+
+from metrics import Gauge
+
+
+load_dotenv()
+
+# "standalone" does everything in one process. "coordinator" receives updates,
+# polls and enriches the feeds and queues alerts; "worker" delivers the queued
+# alerts for its slice of the chats. Both need STORAGE_BACKEND=sqlite on a path
+# every process can open. Coordinators serve HTTP on PORT, so a standby on the
+# same host as the active one needs a PORT of its own.
+BOT_ROLE = os.environ.get("BOT_ROLE", "standalone")
+# Workers serve no HTTP unless given a port here (for /metrics and /admin); each
+# worker on a host then needs a different one.
+WORKER_HTTP_PORT = os.environ.get("WORKER_HTTP_PORT", "")
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+CLUSTER_HEARTBEAT = float(os.environ.get("CLUSTER_HEARTBEAT", 5))
+# A worker whose heartbeat is older than this is treated as dead and its chats move on.
+CLUSTER_WORKER_TTL = float(os.environ.get("CLUSTER_WORKER_TTL", 20))
+# Only the holder of the coordinator lease polls the feeds and writes sent-state.
+CLUSTER_LEASE = float(os.environ.get("CLUSTER_LEASE", 30))
+CLUSTER_VNODES = int(os.environ.get("CLUSTER_VNODES", 64))
+# How often a worker looks for newly queued deliveries.
+CLUSTER_POLL_INTERVAL = float(os.environ.get("CLUSTER_POLL_INTERVAL", 1))
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS workers (
+        worker_id TEXT PRIMARY KEY,
+        heartbeat_at REAL NOT NULL,
+        started_at REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS leases (
+        name TEXT PRIMARY KEY,
+        holder TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    );
+"""
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash of chat IDs onto workers, ``vnodes`` points per worker.
+
+    When a worker joins or leaves only the chats next to its points move.
+    """
+
+    def __init__(self, members=(), vnodes=CLUSTER_VNODES):
+        self.members = tuple(sorted(members))
+        points = sorted((_hash(f"{member}#{i}"), member) for member in self.members for i in range(vnodes))
+        self.hashes = [h for h, _ in points]
+        self.owners = [member for _, member in points]
+
+    def owner(self, chat_id):
+        if not self.owners:
+            return None
+        return self.owners[bisect(self.hashes, _hash(chat_id)) % len(self.owners)]
+
+    def successors(self, chat_id):
+        """Every member once, in ring order starting with the chat's owner."""
+        start = bisect(self.hashes, _hash(chat_id))
+        found = []
+        for i in range(len(self.owners)):
+            member = self.owners[(start + i) % len(self.owners)]
+            if member not in found:
+                found.append(member)
+                if len(found) == len(self.members):
+                    break
+        return found
+
+
+class Cluster:
+    """Membership, chat ownership and leases kept in the shared SQLite store.
+
+    Every process heartbeats into ``workers``; each worker builds the same
+    ring from the live rows and claims only outbox rows for chats it owns,
+    so a join or a missed heartbeat rebalances on the next beat. Rows a dead
+    worker had leased become due again once their outbox lease runs out.
+    """
+
+    def __init__(self, store, worker_id=WORKER_ID, role=BOT_ROLE):
+        self.store = store
+        self.worker_id = worker_id
+        self.role = role
+        self.store.conn.executescript(SCHEMA)
+        self.ring = HashRing()
+        self.rebalances = 0
+        self.leases = set()
+
+    # --------------- membership ---------------
+
+    def _heartbeat(self):
+        now = time.time()
+        if self.role == "worker":
+            self.store.execute(
+                "INSERT INTO workers (worker_id, heartbeat_at, started_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at",
+                (self.worker_id, now, now))
+        rows = self.store.execute("SELECT worker_id FROM workers WHERE heartbeat_at >= ?", (now - CLUSTER_WORKER_TTL,))
+        return [row[0] for row in rows]
+
+    async def heartbeat(self):
+        members = await asyncio.to_thread(self._heartbeat)
+        if tuple(sorted(members)) != self.ring.members:
+            self.ring = HashRing(members)
+            self.rebalances += 1
+            print(f"🔀 Rebalanced chats over {len(members)} workers: {', '.join(self.ring.members)}")
+            return True
+        return False
+
+    def owns(self, chat_id):
+        return self.ring.owner(chat_id) == self.worker_id
+
+    def _leave(self):
+        self.store.execute("DELETE FROM workers WHERE worker_id = ?", (self.worker_id,))
+        self.store.execute("DELETE FROM leases WHERE holder = ?", (self.worker_id,))
+
+    async def leave(self):
+        """Drop out of the ring and give up leases so the others take over at once."""
+        await asyncio.to_thread(self._leave)
+
+    # --------------- leases ---------------
+
+    def _acquire(self, name, ttl):
+        now = time.time()
+        self.store.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (name, self.worker_id, now + ttl, now))
+        rows = self.store.execute("SELECT holder FROM leases WHERE name = ?", (name,))
+        return bool(rows) and rows[0][0] == self.worker_id
+
+    async def acquire(self, name, ttl=CLUSTER_LEASE):
+        """Take or renew the named lease; True while this process holds it."""
+        held = await asyncio.to_thread(self._acquire, name, ttl)
+        if held and name not in self.leases:
+            print(f"🔒 {self.worker_id} holds the {name} lease")
+        elif not held and name in self.leases:
+            print(f"🔓 {self.worker_id} lost the {name} lease")
+        (self.leases.add if held else self.leases.discard)(name)
+        return held
+
+    def stats(self):
+        return {
+            "worker_id": self.worker_id,
+            "role": self.role,
+            "workers": len(self.ring.members),
+            "rebalances": self.rebalances,
+            "leases": sorted(self.leases),
+        }
+
+
+def open_cluster(store, role=BOT_ROLE):
+    cluster = Cluster(store, role=role)
+    Gauge("dexmonitor_cluster_workers", "Live workers in the delivery ring.", callback=lambda: len(cluster.ring.members))
+    return cluster
+
+
+async def run_with_lease(cluster, name, make_tasks):
+    """Run ``make_tasks()`` only while holding ``name``; a standby takes over when the holder dies.
+
+    ``make_tasks`` is called afresh every time the lease is (re)acquired and
+    returns the coroutines to run; they are cancelled if the lease is lost.
+    """
+    tasks = []
+    try:
+        while True:
+            try:
+                held = await cluster.acquire(name)
+            except Exception as e:
+                print(f"Error renewing {name} lease: {e}")
+                held = False
+            if held and not tasks:
+                tasks = [asyncio.create_task(coro) for coro in make_tasks()]
+            elif not held and tasks:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                tasks = []
+            await asyncio.sleep(CLUSTER_LEASE / 3)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_membership_loop(cluster, on_rebalance=None):
+    while True:
+        try:
+            if await cluster.heartbeat() and on_rebalance is not None:
+                on_rebalance(cluster)
+        except Exception as e:
+            print(f"Error in cluster heartbeat: {e}")
+        await asyncio.sleep(CLUSTER_HEARTBEAT)
@@ -0,0 +1,170 @@
+import asyncio
+import datetime
+import os
+import time
+
+from dotenv import load_dotenv
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+from metrics import Gauge, RATE_LIMITED, SEND_FAILURES, SEND_SECONDS, SENDS
+
+
+load_dotenv()
+
+# Telegram allows roughly 30 messages/s per bot and 20 messages/min per group or channel.
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_GLOBAL_BURST = float(os.environ.get("TELEGRAM_GLOBAL_BURST", 30))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", 20 / 60))
+TELEGRAM_CHAT_BURST = float(os.environ.get("TELEGRAM_CHAT_BURST", 3))
+DISPATCH_CONCURRENCY = int(os.environ.get("DISPATCH_CONCURRENCY", 20))
+DISPATCH_MAX_RETRIES = int(os.environ.get("DISPATCH_MAX_RETRIES", 3))
+
+
+def retry_after_seconds(error):
+    delay = error.retry_after
+    if isinstance(delay, datetime.timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+class TokenBucket:
+    """Async token bucket; waiters are served in arrival order."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        """Hold every waiter for at least ``seconds`` (used for RetryAfter)."""
+        self._refill(time.monotonic())
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Dispatcher:
+    """Concurrent fan-out of one send to many chats under Telegram's rate limits.
+
+    Every send takes a token from its chat's bucket and from the global
+    bucket. A RetryAfter pauses that chat for the requested time and halves
+    the global rate; successful sends grow it back towards the configured
+    ceiling. A RetryAfter longer than ``max_retry_after`` is raised at once
+    instead of waited out, so a bot pool can move the send to another bot.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, global_burst=TELEGRAM_GLOBAL_BURST,
+                 chat_rate=TELEGRAM_CHAT_RATE, chat_burst=TELEGRAM_CHAT_BURST,
+                 concurrency=DISPATCH_CONCURRENCY, max_retries=DISPATCH_MAX_RETRIES, max_retry_after=None):
+        self.max_global_rate = global_rate
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.sent = 0
+        self.failed = 0
+        self.retry_afters = 0
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _on_success(self):
+        bucket = self.global_bucket
+        if bucket.rate < self.max_global_rate:
+            bucket.rate = min(self.max_global_rate, bucket.rate + 0.5)
+
+    def _on_retry_after(self, chat_id, seconds):
+        self.retry_afters += 1
+        self.chat_bucket(chat_id).pause(seconds)
+        bucket = self.global_bucket
+        bucket.rate = max(1.0, bucket.rate / 2)
+
+    def set_global_rate(self, rate):
+        """Change the ceiling of the global rate, e.g. when several workers share one bot token."""
+        self.max_global_rate = rate
+        self.global_bucket.rate = min(self.global_bucket.rate, rate)
+        self.global_bucket.capacity = min(TELEGRAM_GLOBAL_BURST, max(1.0, rate))
+
+    async def send(self, chat_id, send):
+        """Run ``send(chat_id)`` under the limits, retrying RetryAfter and network errors."""
+        with SEND_SECONDS.time():
+            return await self._send(chat_id, send)
+
+    async def _send(self, chat_id, send):
+        for attempt in range(self.max_retries + 1):
+            # Waiting for the chat's own bucket (and any RetryAfter pause on it) holds no
+            # concurrency slot, so one throttled chat never stalls the sends to the others.
+            await self.chat_bucket(chat_id).acquire()
+            try:
+                async with self.semaphore:
+                    await self.global_bucket.acquire()
+                    result = await send(chat_id)
+                self._on_success()
+                self.sent += 1
+                SENDS.inc()
+                return result
+            except RetryAfter as e:
+                RATE_LIMITED.labels("telegram").inc()
+                seconds = retry_after_seconds(e)
+                print(f"⏳ Rate limited on {chat_id}, retrying in {seconds}s")
+                self._on_retry_after(chat_id, seconds)
+                if attempt == self.max_retries or (
+                        self.max_retry_after is not None and seconds > self.max_retry_after):
+                    raise
+            except (TimedOut, NetworkError):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def fan_out(self, chat_ids, send):
+        """Send to every chat concurrently; returns {chat_id: result or exception}."""
+        chat_ids = list(chat_ids)
+        results = await asyncio.gather(
+            *(self.send(chat_id, send) for chat_id in chat_ids),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                self.failed += 1
+                SEND_FAILURES.labels(type(result).__name__).inc()
+        return dict(zip(chat_ids, results))
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_afters": self.retry_afters,
+            "global_rate": self.global_bucket.rate,
+            "chats": len(self.chat_buckets),
+        }
+
+
+dispatcher = Dispatcher()
+
+Gauge("dexmonitor_dispatch_global_rate", "Current adaptive global send rate (messages/s).",
+      callback=lambda: dispatcher.global_bucket.rate)
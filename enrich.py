@@ -0,0 +1,240 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+import httpx
+from dotenv import load_dotenv
+
+import upstream
+from metrics import Gauge, RATE_LIMITED, UPSTREAM_ERRORS
+from records import decode_pairs
+
+
+load_dotenv()
+
+TOKEN_PROFILE_NAMES = os.environ.get("TOKEN_PROFILE_NAMES")
+# The token endpoint accepts up to 30 comma-separated addresses per call.
+ENRICH_BATCH_SIZE = int(os.environ.get("ENRICH_BATCH_SIZE", 30))
+ENRICH_CONCURRENCY = int(os.environ.get("ENRICH_CONCURRENCY", 4))
+# Pair data shared by the token, boost and trending feeds.
+PAIR_CACHE_TTL = float(os.environ.get("PAIR_CACHE_TTL", 120))
+PAIR_CACHE_NEGATIVE_TTL = float(os.environ.get("PAIR_CACHE_NEGATIVE_TTL", 30))
+PAIR_CACHE_SIZE = int(os.environ.get("PAIR_CACHE_SIZE", 5000))
+
+
+# Result of a lookup that failed outright, as opposed to a token that has no pair.
+LOOKUP_FAILED = object()
+
+
+def token_key(chain_id, token_address):
+    return (chain_id, token_address)
+
+
+class PairCache:
+    """TTL + LRU cache of pair lookups keyed by (chainId, tokenAddress).
+
+    Tokens without a pair are cached too, for the shorter negative TTL.
+    Lookups already in flight are tracked in ``pending`` so concurrent
+    callers wait on the same upstream request instead of issuing their own.
+    Expired pairs stay until the LRU pushes them out, for ``get_stale``.
+    """
+
+    def __init__(self, ttl=PAIR_CACHE_TTL, negative_ttl=PAIR_CACHE_NEGATIVE_TTL, max_size=PAIR_CACHE_SIZE):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get(self, key):
+        """Return (found, pair); found is False on a miss or an expired entry."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, pair = entry
+        if expires_at < time.monotonic():
+            return False, None
+        self.entries.move_to_end(key)
+        return True, pair
+
+    def get_stale(self, key):
+        """The last pair seen for key even if expired, for when the lookup host is down."""
+        entry = self.entries.get(key)
+        return entry[1] if entry else None
+
+    def put(self, key, pair):
+        ttl = self.ttl if pair else self.negative_ttl
+        self.entries[key] = (time.monotonic() + ttl, pair)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+
+pair_cache = PairCache()
+# Shared by every feed, so ENRICH_CONCURRENCY bounds the batches in flight across the process.
+enrich_slots = asyncio.Semaphore(ENRICH_CONCURRENCY)
+
+Gauge("dexmonitor_pair_cache", "Pair cache size and lookup counters.", ("stat",),
+      callback=lambda: {(key,): value for key, value in pair_cache.stats().items()})
+
+
+def group_by_chain(tokens):
+    """Unique addresses per chain, in feed order."""
+    chains = {}
+    for tok in tokens:
+        token_address = tok.tokenAddress
+        chain_id = tok.chainId
+        if not token_address or not chain_id:
+            continue
+        addresses = chains.setdefault(chain_id, [])
+        if token_address not in addresses:
+            addresses.append(token_address)
+    return chains
+
+
+def match_pairs(chain_id, addresses, pairs):
+    """Spread a multi-address response back to the addresses that were asked for.
+
+    A token keeps the first pair where it is the base token, the same pair
+    a single-address lookup would have put first. Pairs where it is only the
+    quote token are used as a fallback.
+    """
+    wanted = {address.lower(): address for address in addresses}
+    found = {}
+    for side in ("baseAddress", "quoteAddress"):
+        for pair in pairs:
+            if (pair.chainId or chain_id) != chain_id:
+                continue
+            address = wanted.get(str(getattr(pair, side) or "").lower())
+            if address and address not in found:
+                found[address] = pair
+    return {token_key(chain_id, address): pair for address, pair in found.items()}
+
+
+async def fetch_pairs_batch(chain_id, addresses, semaphore):
+    """Look up one batch; returns ({key: pair}, addresses whose lookup failed).
+
+    A batch the API rejects as a whole (4xx) is split in halves and retried,
+    so one malformed address only costs its own lookup.
+    """
+    status = None
+    async with semaphore:
+        try:
+            response = await upstream.get("pairs", f"{TOKEN_PROFILE_NAMES}/{','.join(addresses)}")
+            status = response.status_code
+            if status == 200:
+                pairs = decode_pairs(response.content)
+            else:
+                UPSTREAM_ERRORS.labels("pairs", str(status)).inc()
+                if status == 429:
+                    RATE_LIMITED.labels("upstream").inc()
+                print(f"⚠️ Pair lookup for {len(addresses)} {chain_id} tokens returned {status}")
+        except Exception as e:
+            if not isinstance(e, (upstream.CircuitOpen, httpx.HTTPError)):
+                UPSTREAM_ERRORS.labels("pairs", type(e).__name__).inc()
+            print(f"Error fetching pairs for {chain_id} batch: {e}")
+            return {}, list(addresses)
+
+    if status != 200:
+        if 400 <= status < 500 and status != 429 and len(addresses) > 1:
+            half = len(addresses) // 2
+            (left, left_failed), (right, right_failed) = await asyncio.gather(
+                fetch_pairs_batch(chain_id, addresses[:half], semaphore),
+                fetch_pairs_batch(chain_id, addresses[half:], semaphore),
+            )
+            return {**left, **right}, left_failed + right_failed
+        return {}, list(addresses)
+
+    return match_pairs(chain_id, addresses, pairs), []
+
+
+async def enrich_tokens(tokens, cache=pair_cache, failed=None):
+    """Look up pair data for every feed item, one request per chain batch.
+
+    Cached pairs are served without a request, and keys another feed is
+    already fetching are awaited rather than fetched twice. When a lookup
+    fails the last known (expired) pair is served instead; keys with no such
+    fallback are added to ``failed`` and never cached. Returns
+    {(chainId, tokenAddress): pair}; tokens with no pair are absent.
+    """
+    loop = asyncio.get_running_loop()
+    pairs = {}
+    waiting = {}
+    missing = {}
+    owned = {}
+
+    for chain_id, addresses in group_by_chain(tokens).items():
+        for address in addresses:
+            key = token_key(chain_id, address)
+            found, pair = cache.get(key)
+            if found:
+                cache.hits += 1
+                if pair:
+                    pairs[key] = pair
+            elif key in cache.pending:
+                cache.coalesced += 1
+                waiting[key] = cache.pending[key]
+            else:
+                cache.misses += 1
+                owned[key] = cache.pending[key] = loop.create_future()
+                missing.setdefault(chain_id, []).append(address)
+
+    batches = [
+        (chain_id, addresses[i:i + ENRICH_BATCH_SIZE])
+        for chain_id, addresses in missing.items()
+        for i in range(0, len(addresses), ENRICH_BATCH_SIZE)
+    ]
+    try:
+        results = await asyncio.gather(*(
+            fetch_pairs_batch(chain_id, batch, enrich_slots) for chain_id, batch in batches
+        ))
+        for (chain_id, batch), (found, batch_failed) in zip(batches, results):
+            batch_failed = set(batch_failed)
+            for address in batch:
+                key = token_key(chain_id, address)
+                if address in batch_failed:
+                    pair = cache.get_stale(key)
+                    if pair:
+                        cache.stale += 1
+                    else:
+                        pair = LOOKUP_FAILED
+                else:
+                    pair = found.get(key)
+                    cache.put(key, pair)
+                owned[key].set_result(pair)
+    finally:
+        for key, future in owned.items():
+            if not future.done():
+                future.set_result(LOOKUP_FAILED)
+            cache.pending.pop(key, None)
+
+    for key, future in list(owned.items()) + list(waiting.items()):
+        pair = await future
+        if pair is LOOKUP_FAILED:
+            if failed is not None:
+                failed.add(key)
+        elif pair:
+            pairs[key] = pair
+    return pairs
@@ -1,186 +1,191 @@
-import json
+import asyncio
 import os
+import time
 import datetime
+from collections import OrderedDict
 
-MAX_TOKENS = 3500
+from dotenv import load_dotenv
+
+from storage import open_storage
+from metrics import Gauge, PERSIST_SECONDS
+from records import Signature
+from seenset import SEEN_MAX_ENTRIES, SeenSet, open_seen_set
+
+
+load_dotenv()
+
+MAX_TOKENS = int(os.environ.get("MAX_TOKENS", 3500))
+# Optional age limit (seconds) for sent-history entries; 0 keeps them until MAX_TOKENS pushes them out.
+SENT_TTL = float(os.environ.get("SENT_TTL", 0))
 SENT_TOKENS_FILE = "sent_tokens.json"
 BOOST_SENT_FILE = "sent_boost.json"
 SENT_TRENDS_FILE = "sent_trends.json"
 CHAT_FILE = "registered_chats.json"
+# SEEN_SET=1 keeps sent-history as a memory-mapped hash table (seen_<kind>.bin in SEEN_DIR)
+# instead of full signatures, for histories of millions of tokens. Storage is still written
+# on every save and then keeps up to SEEN_MAX_ENTRIES per history, as the seen-set does, so
+# a rebuild from it recovers the whole history; the files are a local cache.
+SEEN_SET = os.environ.get("SEEN_SET", "0") == "1"
+SEEN_DIR = os.environ.get("SEEN_DIR", ".")
+SENT_FILES = {
+    "tokens": SENT_TOKENS_FILE,
+    "boosts": BOOST_SENT_FILE,
+    "trends": SENT_TRENDS_FILE,
+}
+
+storage = open_storage(SENT_FILES, CHAT_FILE, max_size=SEEN_MAX_ENTRIES if SEEN_SET else MAX_TOKENS, ttl=SENT_TTL)
 
 
 # =================== UTILITIES ===================9
 
-def replace_or_add(signature, existing_signatures):
-    replaced = False
-    for i, entry in enumerate(existing_signatures):
-        if entry["tokenAddress"] == signature["tokenAddress"] and entry["chainId"] == signature["chainId"]:
-            # Check if values differ
-            if entry != signature:
-                existing_signatures[i] = signature  # Update existing
-                replaced = True
-            return existing_signatures, replaced
-    existing_signatures.append(signature)
-    return existing_signatures, True  # New entry added
-
-
-# =================== TOKENS ===================
-
-async def load_sent_file():
-    if not os.path.exists(SENT_TOKENS_FILE):
-        return []
-    with open(SENT_TOKENS_FILE, "r") as f:
-        return json.load(f)
-
-
-def save_sent_file(new_tokens):
-    existing_tokens = []
-    if os.path.exists(SENT_TOKENS_FILE):
-        try:
-            with open(SENT_TOKENS_FILE, "r") as f:
-                existing_tokens = json.load(f)
-        except json.JSONDecodeError:
-            print("⚠️ Warning: Corrupted sent_tokens.json. Resetting.")
-
-    for token in new_tokens:
-        existing_tokens, _ = replace_or_add(token, existing_tokens)
-
-    trimmed = existing_tokens[-MAX_TOKENS:]
-    with open(SENT_TOKENS_FILE, "w") as f:
-        json.dump(trimmed, f, indent=2)
-
-
-def is_token_already_sent(signature, sent_signatures):
-    for entry in sent_signatures:
-        if entry["tokenAddress"] == signature["tokenAddress"] and entry["chainId"] == signature["chainId"]:
-            return entry == signature  # True if identical
-    return False
-
-def make_token_signature(name, token_address, symbol, chain_id):
-    return {
-        "name": name,
-        "tokenAddress": token_address,
-        "symbol": symbol,
-        "chainId": chain_id
-    }
-# def make_token_signature(name, token_address, symbol, chain_id, volume_24h, liquidity_usd, market_cap, created_at):
-#     return {
-#         "name": name,
-#         "tokenAddress": token_address,
-#         "symbol": symbol,
-#         "chainId": chain_id,
-#         "volume": volume_24h,
-#         "liquidity": liquidity_usd,
-#         "marketCap": market_cap,
-#         "pairCreatedAt": created_at
-#     }
-
-# =================== BOOSTED ===================
-
-async def load_boosted_tokens():
-    if not os.path.exists(BOOST_SENT_FILE):
-        return []
-    with open(BOOST_SENT_FILE, "r") as f:
-        return json.load(f)
-
-
-async def save_boosted_tokens(new_tokens):
-    existing = []
-    if os.path.exists(BOOST_SENT_FILE):
-        try:
-            with open(BOOST_SENT_FILE, "r") as f:
-                existing = json.load(f)
-        except json.JSONDecodeError:
-            print("⚠️ Warning: Corrupted boost file. Resetting.")
-
-    for token in new_tokens:
-        existing, _ = replace_or_add(token, existing)
-
-    trimmed = existing[-MAX_TOKENS:]
-    with open(BOOST_SENT_FILE, "w") as f:
-        json.dump(trimmed, f, indent=2)
-
-
-def make_boost_signature(name, token_address, chain_id, amount=0, totalAmount=0):
-    return {
-        "name": name,
-        "tokenAddress": token_address,
-        "chainId": chain_id,
-        "amount": amount,
-        "totalAmount": totalAmount
-    }
-
-
-def is_boost_already_sent(signature, sent_list):
-    for entry in sent_list:
-        if entry["tokenAddress"] == signature["tokenAddress"] and entry["chainId"] == signature["chainId"]:
-            return entry == signature
-    return False
-
-# =================== TRENDING ===================
-
-async def load_trending_tokens():
-    if not os.path.exists(SENT_TRENDS_FILE):
-        return []
-    with open(SENT_TRENDS_FILE, "r") as f:
-        return json.load(f)
-
-
-async def save_trending_tokens(new_tokens):
-    existing = []
-    if os.path.exists(SENT_TRENDS_FILE):
-        try:
-            with open(SENT_TRENDS_FILE, "r") as f:
-                existing = json.load(f)
-        except json.JSONDecodeError:
-            print("⚠️ Warning: Corrupted trends file. Resetting.")
-
-    for token in new_tokens:
-        existing, _ = replace_or_add(token, existing)
-
-    trimmed = existing[-MAX_TOKENS:]
-    with open(SENT_TRENDS_FILE, "w") as f:
-        json.dump(trimmed, f, indent=2)
-
-def make_trending_signature(name, token_address, symbol, chain_id):
-    return {
-        "name": name,
-        "tokenAddress": token_address,
-        "symbol": symbol,
-        "chainId": chain_id
-    }
-
-# def make_trending_signature(name, token_address, symbol, chain_id, volume_24h, liquidity_usd, market_cap, created_at):
-#     return {
-#         "name": name,
-#         "tokenAddress": token_address,
-#         "symbol": symbol,
-#         "chainId": chain_id,
-#         "volume": volume_24h,
-#         "liquidity": liquidity_usd,
-#         "marketCap": market_cap,
-#         "pairCreatedAt": created_at
-#     }
-
-
-def is_trend_already_sent(signature, sent_list):
-    for entry in sent_list:
-        if entry["tokenAddress"] == signature["tokenAddress"] and entry["chainId"] == signature["chainId"]:
-            return entry == signature
-    return False
+class DedupIndex:
+    """Sent signatures keyed by (chainId, tokenAddress) with O(1) lookup and upsert.
+
+    Entries stay in insertion order (an updated entry moves to the end) and
+    the oldest are dropped past max_size, like the old [-MAX_TOKENS:] slice.
+    With a ttl, entries older than ttl seconds are dropped as well.
+    Token, boost and trending signatures all use it.
+    """
+
+    def __init__(self, signatures=(), max_size=MAX_TOKENS, ttl=SENT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        now = time.time()
+        for signature in signatures:
+            self._set(signature, now)
+        self._evict(now)
+
+    @staticmethod
+    def key(signature):
+        return (signature["chainId"], signature["tokenAddress"])
+
+    def _set(self, signature, now):
+        key = self.key(signature)
+        self.entries.pop(key, None)
+        self.entries[key] = (signature, now)
+
+    def _evict(self, now):
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        if self.ttl:
+            cutoff = now - self.ttl
+            while self.entries:
+                _, (_, added) = next(iter(self.entries.items()))
+                if added >= cutoff:
+                    break
+                self.entries.popitem(last=False)
+
+    def get(self, signature):
+        entry = self.entries.get(self.key(signature))
+        if entry is None:
+            return None
+        if self.ttl and entry[1] < time.time() - self.ttl:
+            return None
+        return entry[0]
+
+    def is_sent(self, signature):
+        return self.get(signature) == signature
+
+    def upsert(self, signature):
+        """Add or replace the entry for this token; True if anything changed."""
+        if self.get(signature) == signature:
+            return False
+        now = time.time()
+        self._set(signature, now)
+        self._evict(now)
+        return True
+
+    def signatures(self):
+        return [signature for signature, _ in self.entries.values()]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, signature):
+        return self.get(signature) is not None
+
+
+_indexes = {}
+# One lock per sent-history, held while it is read from storage and while it is saved.
+_index_locks = {}
+
+
+def _read_index(kind):
+    with PERSIST_SECONDS.labels("load", kind).time():
+        if SEEN_SET:
+            path = os.path.join(SEEN_DIR, f"seen_{kind}.bin")
+            return open_seen_set(path, lambda: storage.load_signatures(kind), ttl=SENT_TTL)
+        return DedupIndex(Signature.from_dict(sig) for sig in storage.load_signatures(kind))
+
+
+async def load_index(kind):
+    """The in-memory index for one sent-history, read from storage (in a thread) on first use.
+
+    With SEEN_SET the seen-set file is mapped instead; the first time it is
+    filled from the signatures in storage.
+    """
+    index = _indexes.get(kind)
+    if index is None:
+        async with _index_locks.setdefault(kind, asyncio.Lock()):
+            index = _indexes.get(kind)
+            if index is None:
+                index = _indexes[kind] = await asyncio.to_thread(_read_index, kind)
+    return index
+
+
+def reset_indexes():
+    """Forget the in-memory indexes so the next use re-reads them (another process may have written)."""
+    for index in _indexes.values():
+        if isinstance(index, SeenSet):
+            index.close()
+    _indexes.clear()
+
+
+async def save_index(kind, new_tokens):
+    index = await load_index(kind)
+    async with _index_locks.setdefault(kind, asyncio.Lock()):
+        if isinstance(index, SeenSet):
+            # Grow the table in a thread first, so the upserts below never rebuild on the loop.
+            await index.reserve(len(new_tokens))
+        changed = [token for token in new_tokens if index.upsert(token)]
+        if not changed:
+            return
+        with PERSIST_SECONDS.labels("save", kind).time():
+            if isinstance(index, SeenSet):
+                # Storage stays the source of truth (another host rebuilds its seen-set
+                # from it); the seen-set cannot give its signatures back, so only the
+                # changed ones are passed.
+                await asyncio.to_thread(index.flush)
+                await asyncio.to_thread(storage.save_signatures, kind, changed, None)
+            else:
+                await asyncio.to_thread(storage.save_signatures, kind, changed, index.signatures())
+
+
+Gauge("dexmonitor_dedup_index_size", "Entries in each sent-history index.", ("kind",),
+      callback=lambda: {(kind,): len(index) for kind, index in list(_indexes.items())})
+
 
 # =================== CHATS ===================
 
 def load_registered_chats():
-    if os.path.exists(CHAT_FILE):
-        with open(CHAT_FILE, "r") as f:
-            return set(json.load(f))
-    return set()
+    with PERSIST_SECONDS.labels("load", "chats").time():
+        return storage.load_chats()
+
+
+async def update_registered_chats(added, removed):
+    with PERSIST_SECONDS.labels("update", "chats").time():
+        await asyncio.to_thread(storage.update_chats, set(added), set(removed))
+
+
+def load_subscriptions():
+    with PERSIST_SECONDS.labels("load", "subscriptions").time():
+        return storage.load_subscriptions()
 
 
-def save_registered_chats(chat_ids):
-    with open(CHAT_FILE, "w") as f:
-        json.dump(list(chat_ids), f)
+async def save_subscription(chat_id, settings):
+    with PERSIST_SECONDS.labels("save", "subscriptions").time():
+        await asyncio.to_thread(storage.save_subscription, chat_id, settings)
 
 # =================== MISC ===================
 
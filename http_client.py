@@ -0,0 +1,98 @@
+import base64
+import gzip
+import json
+import os
+import time
+import httpx
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# One pooled client shared by every upstream call (feeds, pair lookups, header images).
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 100))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.environ.get("HTTP_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", 30))
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", 20))
+# When set, every upstream response is appended to a gzip JSON-lines capture in this
+# directory, for offline replay with replay.py.
+CAPTURE_DIR = os.environ.get("CAPTURE_DIR")
+
+try:
+    import h2  # noqa: F401  (httpx only negotiates HTTP/2 when the h2 package is installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_client = None
+_capture = None
+
+
+class CaptureWriter:
+    """Appends raw upstream responses to capture-<timestamp>.jsonl.gz."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"capture-{time.strftime('%Y%m%d-%H%M%S')}.jsonl.gz")
+        self.file = gzip.open(self.path, "at")
+        self.write({
+            "type": "meta",
+            "t": time.time(),
+            "env": {key: os.environ.get(key) for key in (
+                "LATEST_TOKEN_PROFILES", "LATEST_BOOST", "TRENDING_TOKENS", "TOKEN_PROFILE_NAMES")},
+        })
+        print(f"🎥 Capturing upstream responses to {self.path}")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    async def on_response(self, response):
+        await response.aread()
+        self.write({
+            "type": "response",
+            "t": time.time(),
+            "url": str(response.request.url),
+            "status": response.status_code,
+            "headers": {key: response.headers[key] for key in ("content-type", "etag", "last-modified")
+                        if key in response.headers},
+            "body": base64.b64encode(response.content).decode(),
+        })
+
+    def close(self):
+        self.file.close()
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE,
+                max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=HTTP_TIMEOUT,
+            follow_redirects=True,
+            event_hooks={"response": [get_capture().on_response]} if CAPTURE_DIR else None,
+        )
+    return _client
+
+
+def get_capture():
+    global _capture
+    if _capture is None:
+        _capture = CaptureWriter(CAPTURE_DIR)
+    return _capture
+
+
+async def close_client():
+    global _client, _capture
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    if _capture is not None:
+        _capture.close()
+        _capture = None
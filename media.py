@@ -0,0 +1,154 @@
+import asyncio
+import os
+from collections import OrderedDict
+from io import BytesIO
+
+import httpx
+from dotenv import load_dotenv
+from telegram.error import BadRequest
+
+import upstream
+from botpool import bot_name
+from metrics import Gauge, UPSTREAM_ERRORS
+
+
+load_dotenv()
+
+MEDIA_CACHE_SIZE = int(os.environ.get("MEDIA_CACHE_SIZE", 500))
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Optional downscale/recompress before the first upload (0 disables it).
+HEADER_MAX_WIDTH = int(os.environ.get("HEADER_MAX_WIDTH", 0))
+HEADER_JPEG_QUALITY = int(os.environ.get("HEADER_JPEG_QUALITY", 85))
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def shrink_image(data, max_width=HEADER_MAX_WIDTH, quality=HEADER_JPEG_QUALITY):
+    """Downscale to max_width and recompress as JPEG; returns the original on any failure."""
+    if Image is None or max_width <= 0:
+        return data
+    try:
+        with Image.open(BytesIO(data)) as img:
+            if img.width > max_width:
+                img.thumbnail((max_width, max_width * img.height // img.width))
+            out = BytesIO()
+            img.convert("RGB").save(out, format="JPEG", quality=quality, optimize=True)
+        shrunk = out.getvalue()
+        return shrunk if len(shrunk) < len(data) else data
+    except Exception as e:
+        print(f"⚠️ Could not shrink header image: {e}")
+        return data
+
+
+class MediaCache:
+    """Header images keyed by URL: downloaded once, uploaded once per bot, then sent by file_id.
+
+    Both the raw bytes and the Telegram file_ids are kept in bounded LRUs
+    that live for the whole process, so a header seen again in a later
+    cycle costs nothing. If the image cannot be fetched the alert is sent
+    as a text message instead.
+    """
+
+    def __init__(self, max_entries=MEDIA_CACHE_SIZE, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.file_ids = OrderedDict()
+        self.total_bytes = 0
+        self.locks = {}
+        self.downloads = 0
+        self.uploads = 0
+        self.reused = 0
+        self.text_fallbacks = 0
+
+    def _remember(self, lru, key, value):
+        lru[key] = value
+        lru.move_to_end(key)
+        while len(lru) > self.max_entries:
+            lru.popitem(last=False)
+
+    def _remember_image(self, url, data):
+        old = self.images.pop(url, None)
+        if old is not None:
+            self.total_bytes -= len(old)
+        self.images[url] = data
+        self.total_bytes += len(data)
+        while self.images and (len(self.images) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, evicted = self.images.popitem(last=False)
+            self.total_bytes -= len(evicted)
+
+    async def get_image(self, url):
+        data = self.images.get(url)
+        if data is not None:
+            self.images.move_to_end(url)
+            return data
+        response = await upstream.get("image", url)
+        if response.status_code != 200:
+            UPSTREAM_ERRORS.labels("image", str(response.status_code)).inc()
+        response.raise_for_status()
+        data = response.content
+        self.downloads += 1
+        if HEADER_MAX_WIDTH > 0:
+            data = await asyncio.to_thread(shrink_image, data)
+        self._remember_image(url, data)
+        return data
+
+    async def send_photo(self, bot, chat_id, url, **kwargs):
+        # file_ids are only valid for the bot that uploaded the file.
+        key = (bot_name(bot), url)
+        file_id = self.file_ids.get(key)
+        if file_id is None:
+            # Only one chat per bot uploads a given header; the rest wait for its file_id.
+            lock = self.locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                file_id = self.file_ids.get(key)
+                if file_id is None:
+                    try:
+                        return await self._upload(bot, chat_id, url, key, **kwargs)
+                    finally:
+                        self.locks.pop(key, None)
+
+        try:
+            message = await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+            self.file_ids.move_to_end(key)
+            self.reused += 1
+            return message
+        except BadRequest:
+            # Stale file_id: forget it and upload the bytes again.
+            self.file_ids.pop(key, None)
+            return await self._upload(bot, chat_id, url, key, **kwargs)
+
+    async def _upload(self, bot, chat_id, url, key, **kwargs):
+        try:
+            data = await self.get_image(url)
+        except (httpx.HTTPError, upstream.CircuitOpen) as e:
+            self.text_fallbacks += 1
+            print(f"⚠️ Header image unavailable ({e}), sending text to {chat_id}")
+            return await bot.send_message(chat_id=chat_id, text=kwargs.pop("caption", ""), **kwargs)
+        image_bytes = BytesIO(data)
+        image_bytes.name = "token_header.png"
+        message = await bot.send_photo(chat_id=chat_id, photo=image_bytes, **kwargs)
+        self.uploads += 1
+        if message and message.photo:
+            self._remember(self.file_ids, key, message.photo[-1].file_id)
+        return message
+
+    def stats(self):
+        return {
+            "images": len(self.images),
+            "bytes": self.total_bytes,
+            "file_ids": len(self.file_ids),
+            "downloads": self.downloads,
+            "uploads": self.uploads,
+            "reused": self.reused,
+            "text_fallbacks": self.text_fallbacks,
+        }
+
+
+media_cache = MediaCache()
+
+Gauge("dexmonitor_media_cache", "Header image cache size and upload counters.", ("stat",),
+      callback=lambda: {(key,): value for key, value in media_cache.stats().items()})
@@ -0,0 +1,209 @@
+import time
+from bisect import bisect_left
+
+
+# Small Prometheus text-format registry. Updating a metric is a dict lookup
+# and an add; everything else (callbacks, cumulative buckets, text) happens
+# only when /metrics is scraped.
+
+REGISTRY = []
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self.new_child()
+        return child
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        """Yield (suffix, label values, extra labels, value)."""
+        for values, child in list(self.children.items()):
+            yield "", values, (), child.value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.collect():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {float(value)!r}")
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A gauge that is either set directly or read from a callback at scrape time.
+
+    The callback returns a number, or a {label values tuple: number} dict
+    for labelled gauges.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def collect(self):
+        if self.callback is None:
+            yield from super().collect()
+            return
+        try:
+            value = self.callback()
+        except Exception as e:
+            print(f"⚠️ Metric {self.name} failed: {e}")
+            return
+        if isinstance(value, dict):
+            for values, v in value.items():
+                yield "", values if isinstance(values, tuple) else (values,), (), v
+        else:
+            yield "", (), (), value
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def collect(self):
+        for values, child in list(self.children.items()):
+            counts = list(child.counts)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield "_bucket", values, (("le", le),), cumulative
+            yield "_sum", values, (), child.sum
+            yield "_count", values, (), cumulative
+
+
+def render():
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# =================== METRICS ===================
+
+STAGE_SECONDS = Histogram(
+    "dexmonitor_stage_seconds", "Time spent in each pipeline stage per feed.", ("feed", "stage"))
+UPSTREAM_SECONDS = Histogram(
+    "dexmonitor_upstream_seconds", "Latency of upstream HTTP calls.", ("endpoint",))
+UPSTREAM_HEDGES = Counter(
+    "dexmonitor_upstream_hedges_total", "Hedged upstream requests by endpoint and which copy answered first.",
+    ("endpoint", "winner"))
+UPSTREAM_ERRORS = Counter(
+    "dexmonitor_upstream_errors_total", "Failed upstream HTTP calls by endpoint and reason.", ("endpoint", "reason"))
+PERSIST_SECONDS = Histogram(
+    "dexmonitor_persist_seconds", "Time spent loading and saving sent-history and chats.", ("op", "kind"))
+FEED_ITEMS = Counter(
+    "dexmonitor_feed_items_total",
+    "Feed items by outcome (seen, unchanged, deferred, skipped, no_header, filtered, coalesced, demoted, stale, sent).",
+    ("feed", "outcome"))
+SEND_SECONDS = Histogram(
+    "dexmonitor_send_seconds", "Latency of Telegram sends, including rate-limit waits.")
+SENDS = Counter(
+    "dexmonitor_sends_total", "Successful Telegram sends.")
+SEND_FAILURES = Counter(
+    "dexmonitor_send_failures_total", "Failed Telegram sends by exception type.", ("error",))
+BOT_SENDS = Counter(
+    "dexmonitor_bot_sends_total", "Telegram sends per pool bot by outcome (sent, failover to another bot, failed for good).",
+    ("bot", "outcome"))
+RATE_LIMITED = Counter(
+    "dexmonitor_rate_limited_total", "429 / RetryAfter responses by source.", ("source",))
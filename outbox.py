@@ -0,0 +1,462 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden
+
+from funct import storage
+from media import media_cache
+from metrics import Gauge
+from registry import is_dead_chat_error
+from storage import SqliteStorage
+
+
+load_dotenv()
+
+# Used only when STORAGE_BACKEND is json; with sqlite the outbox shares that database.
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", "outbox.db")
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_BASE_BACKOFF = float(os.environ.get("OUTBOX_BASE_BACKOFF", 15))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", 1800))
+OUTBOX_RETRY_INTERVAL = float(os.environ.get("OUTBOX_RETRY_INTERVAL", 10))
+# A row being sent is hidden from the retry loop this long, so it is never sent twice at once.
+OUTBOX_LEASE = float(os.environ.get("OUTBOX_LEASE", 120))
+# Alerts a newly registered chat receives from before it joined.
+OUTBOX_BACKFILL = int(os.environ.get("OUTBOX_BACKFILL", 5))
+OUTBOX_ALERT_RETENTION = float(os.environ.get("OUTBOX_ALERT_RETENTION", 24 * 3600))
+OUTBOX_LEDGER_RETENTION = float(os.environ.get("OUTBOX_LEDGER_RETENTION", 7 * 24 * 3600))
+# A changed alert (its feed signature changed, which only boosts' does for metrics) edits the
+# caption of the chat's earlier post instead of posting again, unless a tracked amount moved by
+# more than ALERT_EDIT_THRESHOLD (relative), the 24h change by more than
+# ALERT_EDIT_PRICE_POINTS percentage points, or the post is older than ALERT_EDIT_MAX_AGE
+# seconds. ALERT_EDITS=0 always posts anew.
+ALERT_EDITS = os.environ.get("ALERT_EDITS", "1") != "0"
+ALERT_EDIT_THRESHOLD = float(os.environ.get("ALERT_EDIT_THRESHOLD", 0.5))
+ALERT_EDIT_PRICE_POINTS = float(os.environ.get("ALERT_EDIT_PRICE_POINTS", 50))
+ALERT_EDIT_MAX_AGE = float(os.environ.get("ALERT_EDIT_MAX_AGE", 6 * 3600))
+SIGNIFICANT_FIELDS = ("totalAmount", "marketCap", "liquidity", "volume", "priceChange")
+# Already a percentage, so compared in points rather than relative to its old value.
+POINT_FIELDS = {"priceChange": ALERT_EDIT_PRICE_POINTS}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        feed TEXT NOT NULL,
+        chain_id TEXT NOT NULL,
+        token_address TEXT NOT NULL,
+        signature_hash TEXT NOT NULL,
+        header TEXT NOT NULL,
+        caption TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        metrics TEXT
+    );
+    CREATE INDEX IF NOT EXISTS alerts_by_age ON alerts (created_at);
+    CREATE TABLE IF NOT EXISTS outbox (
+        chat_id INTEGER NOT NULL,
+        feed TEXT NOT NULL,
+        chain_id TEXT NOT NULL,
+        token_address TEXT NOT NULL,
+        alert_id INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL,
+        last_error TEXT,
+        message_id INTEGER,
+        leased_until REAL,
+        PRIMARY KEY (chat_id, feed, chain_id, token_address)
+    );
+    CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at);
+    CREATE INDEX IF NOT EXISTS outbox_by_alert ON outbox (alert_id);
+    CREATE TABLE IF NOT EXISTS ledger (
+        chat_id INTEGER NOT NULL,
+        feed TEXT NOT NULL,
+        chain_id TEXT NOT NULL,
+        token_address TEXT NOT NULL,
+        signature_hash TEXT NOT NULL,
+        message_id INTEGER,
+        delivered_at REAL NOT NULL,
+        metrics TEXT,
+        posted_at REAL,
+        PRIMARY KEY (chat_id, feed, chain_id, token_address)
+    );
+    CREATE INDEX IF NOT EXISTS ledger_by_age ON ledger (delivered_at);
+"""
+# Columns added after the first release, for databases created before them.
+MIGRATIONS = (
+    ("alerts", "metrics", "TEXT"),
+    ("outbox", "message_id", "INTEGER"),
+    ("outbox", "leased_until", "REAL"),
+    ("ledger", "metrics", "TEXT"),
+    ("ledger", "posted_at", "REAL"),
+)
+
+
+def signature_hash(signature):
+    return hashlib.blake2b(json.dumps(dict(signature), sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def alert_metrics(record):
+    return {field: record[field] for field in SIGNIFICANT_FIELDS
+            if isinstance(record.get(field), (int, float)) and not isinstance(record.get(field), bool)}
+
+
+def is_significant(before, after, threshold=ALERT_EDIT_THRESHOLD):
+    """True if any tracked metric moved by more than ``threshold`` relative to ``before``
+    (or, for POINT_FIELDS, by more than their number of points)."""
+    for field, value in after.items():
+        old = before.get(field)
+        if old is None:
+            continue
+        if field in POINT_FIELDS:
+            if abs(value - old) > POINT_FIELDS[field]:
+                return True
+        elif old == 0:
+            if value:
+                return True
+        elif abs(value - old) / abs(old) > threshold:
+            return True
+    return False
+
+
+class Outbox:
+    """Durable per-chat delivery queue plus a ledger of what each chat already has.
+
+    An alert is written to ``alerts`` and one ``outbox`` row per chat before
+    anything is sent. A successful send moves the row into ``ledger``; a
+    failed one stays queued with exponential backoff, and ``retry_due``
+    picks it up again, including after a restart. Chats whose ledger
+    already holds the same signature are not queued again.
+
+    A chat that already has an earlier version of the alert gets that
+    post's caption edited (the row carries its ``message_id``) unless the
+    change is significant; the ledger keeps the metrics of the last fresh
+    post as the baseline for that decision.
+
+    In sharded mode the coordinator sets ``inline`` to False and only
+    queues, and each worker sets ``owns`` so it claims just its own chats.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.store.conn.executescript(SCHEMA)
+        self._migrate()
+        self.inline = True
+        self.owns = None
+        # Called with (chat_id, error) when Telegram says a chat is gone for good.
+        self.on_dead_chat = None
+        self.store.conn.create_function("owns_chat", 1, lambda chat_id: self.owns is None or self.owns(chat_id))
+        self.delivered = 0
+        self.retried = 0
+        self.dropped = 0
+        self.edited = 0
+
+    def _migrate(self):
+        for table, column, kind in MIGRATIONS:
+            columns = {row[1] for row in self.store.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self.store.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    # --------------- queueing ---------------
+
+    def _enqueue(self, feed, record, signature, caption, chat_ids, lease):
+        chain_id, token_address = str(record["chainId"]), str(record["tokenAddress"])
+        sig_hash = signature_hash(signature)
+        metrics = alert_metrics(record)
+        now = time.time()
+        posted = {
+            row[0]: row[1:] for row in self.store.execute(
+                "SELECT chat_id, signature_hash, message_id, metrics, posted_at FROM ledger "
+                "WHERE feed = ? AND chain_id = ? AND token_address = ?", (feed, chain_id, token_address))
+        }
+        targets = []
+        for chat_id in chat_ids:
+            previous = posted.get(chat_id)
+            if previous is None:
+                targets.append((chat_id, None))
+                continue
+            old_hash, message_id, old_metrics, posted_at = previous
+            if old_hash == sig_hash:
+                continue
+            editable = (ALERT_EDITS and message_id and posted_at and now - posted_at < ALERT_EDIT_MAX_AGE
+                        and not is_significant(json.loads(old_metrics or "{}"), metrics))
+            targets.append((chat_id, message_id if editable else None))
+        if not targets:
+            return None, [], []
+
+        with self.store.lock:
+            conn = self.store.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A row someone is delivering right now is left alone: replacing it would post the
+                # new version fresh on top of the one going out. The caller tries again later.
+                in_flight = {row[0] for row in conn.execute(
+                    "SELECT chat_id FROM outbox WHERE feed = ? AND chain_id = ? AND token_address = ? "
+                    "AND leased_until > ?", (feed, chain_id, token_address, now))}
+                deferred = [chat_id for chat_id, _ in targets if chat_id in in_flight]
+                targets = [target for target in targets if target[0] not in in_flight]
+                if not targets:
+                    conn.execute("COMMIT")
+                    return None, [], deferred
+                alert_id = conn.execute(
+                    "INSERT INTO alerts (feed, chain_id, token_address, signature_hash, header, caption, created_at, "
+                    "metrics) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (feed, chain_id, token_address, sig_hash, record["header"], caption, now, json.dumps(metrics)),
+                ).lastrowid
+                # A newer version of the same token replaces one still waiting in the queue.
+                conn.executemany(
+                    "INSERT INTO outbox (chat_id, feed, chain_id, token_address, alert_id, attempts, next_attempt_at, "
+                    "message_id, leased_until) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?) "
+                    "ON CONFLICT (chat_id, feed, chain_id, token_address) DO UPDATE SET "
+                    "alert_id = excluded.alert_id, attempts = 0, next_attempt_at = excluded.next_attempt_at, "
+                    "message_id = excluded.message_id, leased_until = excluded.leased_until",
+                    [(chat_id, feed, chain_id, token_address, alert_id, now + lease, message_id,
+                      now + lease if lease else None)
+                     for chat_id, message_id in targets],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return alert_id, targets, deferred
+
+    async def enqueue(self, feed, record, signature, caption, chat_ids, lease=OUTBOX_LEASE):
+        """Persist an alert for every chat that does not have it yet.
+
+        Returns (alert_id, [(chat_id, message_id to edit or None), ...], [deferred chat_id, ...]);
+        chats whose earlier version is being delivered right now are deferred, not queued.
+
+        The rows stay hidden from ``retry_due`` for ``lease`` seconds while the caller delivers them.
+        """
+        return await self._run(self._enqueue, feed, record, signature, caption, list(chat_ids), lease)
+
+    def _backfill(self, chat_id, limit):
+        rows = self.store.execute(
+            "SELECT a.id, a.feed, a.chain_id, a.token_address FROM alerts a "
+            "WHERE a.id = (SELECT MAX(id) FROM alerts b WHERE b.feed = a.feed AND b.chain_id = a.chain_id "
+            "AND b.token_address = a.token_address) ORDER BY a.id DESC LIMIT ?", (limit,))
+        now = time.time()
+        self.store.transaction([(
+            "INSERT OR IGNORE INTO outbox (chat_id, feed, chain_id, token_address, alert_id, attempts, next_attempt_at) "
+            "VALUES (?, ?, ?, ?, ?, 0, ?)",
+            [(chat_id, feed, chain, token, alert_id, now) for alert_id, feed, chain, token in rows],
+        )])
+        return len(rows)
+
+    async def backfill(self, chat_id, limit=OUTBOX_BACKFILL):
+        """Queue the most recent alerts for a chat that just registered."""
+        if limit <= 0:
+            return 0
+        return await self._run(self._backfill, chat_id, limit)
+
+    # --------------- delivery ---------------
+
+    def _claim_due(self, now, limit):
+        """Take the due rows and lease them so nothing else picks them up meanwhile."""
+        with self.store.lock:
+            conn = self.store.conn
+            # Other processes may share the database, so select and lease in one write transaction.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT o.chat_id, o.feed, o.chain_id, o.token_address, o.alert_id, o.attempts, a.header, "
+                    "a.caption, o.message_id FROM outbox o JOIN alerts a ON a.id = o.alert_id "
+                    "WHERE o.next_attempt_at <= ? AND owns_chat(o.chat_id) ORDER BY o.next_attempt_at LIMIT ?",
+                    (now, limit)).fetchall()
+                conn.executemany(
+                    "UPDATE outbox SET next_attempt_at = ?, leased_until = ? WHERE chat_id = ? AND feed = ? "
+                    "AND chain_id = ? AND token_address = ?",
+                    [(now + OUTBOX_LEASE, now + OUTBOX_LEASE) + tuple(row[:4]) for row in rows])
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [dict(zip(DELIVERY_FIELDS, row)) for row in rows]
+
+    def _settle(self, acked, failed, dropped, dead_chats=(), reposts=()):
+        now = time.time()
+
+        def key(row):
+            return (row["chat_id"], row["feed"], row["chain_id"], row["token_address"], row["alert_id"])
+
+        where = "WHERE chat_id = ? AND feed = ? AND chain_id = ? AND token_address = ? AND alert_id = ?"
+        posted = [(row, message_id) for row, message_id in acked if not row["message_id"]]
+        edited = [row for row, _ in acked if row["message_id"]]
+        self.store.transaction([
+            # A fresh post also resets the baseline the next change is measured against.
+            ("INSERT INTO ledger (chat_id, feed, chain_id, token_address, signature_hash, message_id, delivered_at, "
+             "metrics, posted_at) SELECT chat_id, feed, chain_id, token_address, "
+             "(SELECT signature_hash FROM alerts WHERE id = outbox.alert_id), ?, ?, "
+             "(SELECT metrics FROM alerts WHERE id = outbox.alert_id), ? FROM outbox " + where +
+             " ON CONFLICT (chat_id, feed, chain_id, token_address) DO UPDATE SET "
+             "signature_hash = excluded.signature_hash, message_id = excluded.message_id, "
+             "delivered_at = excluded.delivered_at, metrics = excluded.metrics, posted_at = excluded.posted_at",
+             [(message_id, now, now) + key(row) for row, message_id in posted]),
+            ("UPDATE ledger SET signature_hash = (SELECT signature_hash FROM alerts WHERE id = ?), delivered_at = ? "
+             "WHERE chat_id = ? AND feed = ? AND chain_id = ? AND token_address = ?",
+             [(row["alert_id"], now) + key(row)[:4] for row in edited]),
+            ("DELETE FROM outbox " + where,
+             [key(row) for row, _ in acked] + [key(row) for row in dropped]),
+            ("UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?, leased_until = NULL "
+             + where,
+             [(now + min(OUTBOX_MAX_BACKOFF, OUTBOX_BASE_BACKOFF * 2 ** row["attempts"]), error) + key(row)
+              for row, error in failed]),
+            ("UPDATE outbox SET message_id = NULL, next_attempt_at = ?, leased_until = NULL " + where,
+             [(now,) + key(row) for row in reposts]),
+            ("DELETE FROM outbox WHERE chat_id = ?", [(chat_id,) for chat_id in dead_chats]),
+        ])
+
+    async def deliver(self, bots, rows):
+        """Send queued rows concurrently through ``bots`` (a BotPool) and record the outcome of each one.
+
+        Rows for the same chat go out in successive rounds, one per chat per round.
+        Rows with a ``message_id`` edit that post's caption; if the post cannot
+        be edited any more they are queued again as a fresh post.
+        Returns the number of rows delivered.
+        """
+        rounds, depth = [], {}
+        for row in rows:
+            n = depth.get(row["chat_id"], 0)
+            depth[row["chat_id"]] = n + 1
+            if n == len(rounds):
+                rounds.append({})
+            rounds[n][row["chat_id"]] = row
+
+        acked, failed, dropped, dead, reposts = [], [], [], {}, []
+        for batch in rounds:
+            # A chat that turned out to be gone is not tried again in later rounds.
+            dropped.extend(row for chat_id, row in batch.items() if chat_id in dead)
+            batch = {chat_id: row for chat_id, row in batch.items() if chat_id not in dead}
+
+            async def send(bot, chat_id, batch=batch):
+                row = batch[chat_id]
+                if row["message_id"]:
+                    return await bot.edit_message_caption(
+                        chat_id=chat_id, message_id=row["message_id"], caption=row["caption"],
+                        parse_mode=ParseMode.HTML,
+                    )
+                return await media_cache.send_photo(
+                    bot, chat_id, row["header"], caption=row["caption"], parse_mode=ParseMode.HTML
+                )
+
+            results = await bots.fan_out(batch, send)
+            for chat_id, row in batch.items():
+                result = results[chat_id]
+                if row["message_id"] and isinstance(result, BadRequest):
+                    if "not modified" in str(result).lower():
+                        acked.append((row, row["message_id"]))
+                    else:
+                        # Deleted, or a text fallback without a caption: post it again instead.
+                        reposts.append(row)
+                elif not isinstance(result, Exception):
+                    acked.append((row, row["message_id"] or getattr(result, "message_id", None)))
+                elif isinstance(result, (Forbidden, BadRequest)) or row["attempts"] + 1 >= OUTBOX_MAX_ATTEMPTS:
+                    print(f"Dropping delivery to {chat_id}: {result}")
+                    dropped.append(row)
+                    if is_dead_chat_error(result):
+                        dead[chat_id] = result
+                else:
+                    print(f"Error sending to {chat_id}: {result}")
+                    failed.append((row, f"{type(result).__name__}: {result}"))
+
+        await self._run(self._settle, acked, failed, dropped, list(dead), reposts)
+        self.delivered += len(acked)
+        self.edited += sum(1 for row, _ in acked if row["message_id"])
+        self.dropped += len(dropped)
+        if self.on_dead_chat is not None:
+            for chat_id, error in dead.items():
+                self.on_dead_chat(chat_id, error)
+        return len(acked)
+
+    async def send_alert(self, bots, feed, record, signature, caption, chat_ids):
+        """Queue an alert for every chat that lacks it, then try to deliver it right away.
+
+        Returns False when there was no chat to queue it for, or when some chat
+        still had its earlier version in flight, so the feed offers it again
+        later; once queued, delivery is the outbox's job even if this first
+        try fails. Without ``inline`` the rows are left due for the workers.
+        """
+        alert_id, targets, deferred = await self.enqueue(
+            feed, record, signature, caption, chat_ids, OUTBOX_LEASE if self.inline else 0)
+        if alert_id is None:
+            return bool(chat_ids) and not deferred
+        if not self.inline:
+            return not deferred
+        rows = [
+            dict(zip(DELIVERY_FIELDS, (chat_id, feed, str(record["chainId"]), str(record["tokenAddress"]),
+                                       alert_id, 0, record["header"], caption, message_id)))
+            for chat_id, message_id in targets
+        ]
+        await self.deliver(bots, rows)
+        return not deferred
+
+    async def retry_due(self, bots, limit=500):
+        rows = await self._run(self._claim_due, time.time(), limit)
+        if rows:
+            self.retried += len(rows)
+            await self.deliver(bots, rows)
+        return len(rows)
+
+    def _prune(self):
+        now = time.time()
+        self.store.transaction([
+            ("DELETE FROM alerts WHERE created_at < ? AND id NOT IN (SELECT alert_id FROM outbox)",
+             (now - OUTBOX_ALERT_RETENTION,)),
+            ("DELETE FROM ledger WHERE delivered_at < ?", (now - OUTBOX_LEDGER_RETENTION,)),
+        ])
+
+    async def prune(self):
+        await self._run(self._prune)
+
+    def _depth(self):
+        return self.store.execute("SELECT COUNT(*) FROM outbox")[0][0]
+
+    async def depth(self):
+        return await self._run(self._depth)
+
+    def stats(self):
+        return {
+            "delivered": self.delivered,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "edited": self.edited,
+        }
+
+
+DELIVERY_FIELDS = (
+    "chat_id", "feed", "chain_id", "token_address", "alert_id", "attempts", "header", "caption", "message_id",
+)
+
+
+def open_outbox():
+    if isinstance(storage, SqliteStorage):
+        return Outbox(storage)
+    return Outbox(SqliteStorage(OUTBOX_PATH))
+
+
+outbox = open_outbox()
+
+Gauge("dexmonitor_outbox_depth", "Deliveries waiting in the outbox.", callback=outbox._depth)
+
+
+async def run_outbox_loop(bots, interval=OUTBOX_RETRY_INTERVAL, deliver=True, prune=True):
+    """Retry due deliveries forever, including ones left over from before a restart.
+
+    A sharded coordinator only prunes and a worker only delivers.
+    """
+    last_prune = 0
+    while True:
+        try:
+            if deliver:
+                await outbox.retry_due(bots)
+            if prune and time.time() - last_prune > 3600:
+                await outbox.prune()
+                last_prune = time.time()
+        except Exception as e:
+            print(f"Error in outbox: {e}")
+        await asyncio.sleep(interval)
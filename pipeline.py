@@ -0,0 +1,273 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+
+from enrich import enrich_tokens, token_key
+from funct import load_index, save_index, token_age, value_number
+from metrics import FEED_ITEMS, STAGE_SECONDS, Gauge
+from records import Signature
+
+
+load_dotenv()
+
+# How many items may wait between two stages before the upstream stage blocks.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", 8))
+# Items enriched per step; smaller steps let the first alerts go out sooner.
+PIPELINE_ENRICH_STEP = int(os.environ.get("PIPELINE_ENRICH_STEP", 10))
+
+
+# Queues of the pipelines currently running, by (feed, stage), for the queue-depth gauge.
+active_queues = {}
+
+
+async def buffered(agen, size=PIPELINE_QUEUE_SIZE, name=None):
+    """Run an async generator in its own task, handing items over through a bounded queue.
+
+    The producer keeps working on the next items while the consumer is busy
+    with the current one, and blocks once ``size`` items are waiting.
+    """
+    queue = asyncio.Queue(size)
+    done = object()
+    if name is not None:
+        active_queues[name] = queue
+
+    async def pump():
+        try:
+            async for item in agen:
+                await queue.put(item)
+        except asyncio.CancelledError:
+            # The consumer is gone; a full queue would block the put below forever.
+            raise
+        except Exception:
+            await queue.put(done)
+            raise
+        await queue.put(done)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+        await task
+    finally:
+        task.cancel()
+        if name is not None and active_queues.get(name) is queue:
+            del active_queues[name]
+
+
+Gauge("dexmonitor_pipeline_queue_depth", "Items waiting between pipeline stages.", ("feed", "stage"),
+      callback=lambda: {name: queue.qsize() for name, queue in list(active_queues.items())})
+
+
+def format_links(links):
+    if not links:
+        return "None"
+    return " | ".join(f"<a href='{url}'>{label}</a>" for label, url in links)
+
+
+def make_record(item, pair, unknown=("Unknown", "Unknown")):
+    """Flatten a FeedItem and its PairSnapshot into the fields signatures and templates use.
+
+    ``unknown`` is the (name, symbol) for a pair that has none.
+    """
+    record = {
+        "tokenAddress": item.tokenAddress or "Unknown",
+        "chainId": item.chainId or "Unknown",
+        "url": item.url or "Unknown",
+        "header": item.header or "Unknown",
+        "amount": item.amount,
+        "totalAmount": item.totalAmount,
+        "links_text": format_links(item.links),
+        "name": "N/A", "symbol": "N/A", "age": "N/A",
+        "main_vol": "N/A", "main_liq": "N/A", "main_cap": "N/A", "priceChange": "N/A",
+        "volume": "N/A", "liquidity": "N/A", "marketCap": "N/A", "pairCreatedAt": "N/A",
+    }
+    if not pair:
+        return record
+
+    record["name"] = pair.name or unknown[0]
+    record["symbol"] = pair.symbol or unknown[1]
+    record["volume"] = pair.volume
+    record["main_vol"] = value_number(pair.volume)
+    record["liquidity"] = pair.liquidity
+    record["main_liq"] = value_number(pair.liquidity)
+    record["priceChange"] = pair.priceChange
+    record["marketCap"] = pair.marketCap
+    record["main_cap"] = value_number(pair.marketCap)
+    record["pairCreatedAt"] = pair.pairCreatedAt
+    record["age"] = token_age(pair.pairCreatedAt)
+    return record
+
+
+def make_signature(feed, record):
+    fields = feed["signature"]
+    return Signature(fields, [record[field] for field in fields])
+
+
+def render(feed, record):
+    return feed["template"].format(**record)
+
+
+# =================== STAGES ===================
+
+async def source_stage(poller):
+    with STAGE_SECONDS.labels(poller.name, "fetch").time():
+        items = await poller.fetch()
+    FEED_ITEMS.labels(poller.name, "seen").inc(len(items))
+    for item in items:
+        yield item
+
+
+async def enrich_stage(feed, items, defer=None):
+    """Enrich a few items at a time so pair lookups stay batched while later stages run."""
+    step = feed.get("enrich_step", PIPELINE_ENRICH_STEP)
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= step:
+            for record in await enrich_batch(feed, batch, defer):
+                yield record
+            batch = []
+    if batch:
+        for record in await enrich_batch(feed, batch, defer):
+            yield record
+
+
+async def enrich_batch(feed, items, defer=None):
+    """Records for the items whose pair lookup worked (or had a cached fallback).
+
+    Items whose lookup failed are left out and handed to ``defer(chainId, tokenAddress)``
+    rather than sent with empty market data; the rest of the batch goes on.
+    """
+    failed = set()
+    with STAGE_SECONDS.labels(feed["name"], "enrich").time():
+        pairs = await enrich_tokens(items, failed=failed)
+    records = []
+    for item in items:
+        key = token_key(item.chainId, item.tokenAddress)
+        if key in failed:
+            FEED_ITEMS.labels(feed["name"], "deferred").inc()
+            if defer is not None:
+                defer(*key)
+            continue
+        records.append(make_record(item, pairs.get(key), feed.get("unknown", ("Unknown", "Unknown"))))
+    return records
+
+
+async def dedup_stage(feed, records):
+    name = feed["name"]
+    dedup_seconds = STAGE_SECONDS.labels(name, "dedup")
+    render_seconds = STAGE_SECONDS.labels(name, "render")
+    sent = await load_index(feed["kind"])
+    async for record in records:
+        with dedup_seconds.time():
+            signature = make_signature(feed, record)
+            already_sent = sent.is_sent(signature)
+        if already_sent:
+            FEED_ITEMS.labels(name, "skipped").inc()
+            print(f"⏭️ Already sent {feed['label']}: {record['name']} [{record['tokenAddress']}]")
+            continue
+        if record["header"] == "Unknown":
+            FEED_ITEMS.labels(name, "no_header").inc()
+            continue
+        with render_seconds.time():
+            message = render(feed, record)
+        yield record, signature, message
+
+
+# Signatures of delivered alerts not saved yet, by feed name; a task per feed saves them,
+# into the feed's kind of sent-history, as they come.
+delivered_signatures = {}
+_save_tasks = {}
+
+
+async def _save_delivered(feed):
+    name = feed["name"]
+    pending = delivered_signatures[name]
+    while pending:
+        batch = list(pending)
+        pending.clear()
+        try:
+            await save_index(feed["kind"], batch)
+        except Exception as e:
+            print(f"Error saving sent {name} signatures: {e}")
+            pending[:0] = batch
+            return
+
+
+def record_delivered(feed, signature):
+    """Save a delivered alert's signature right away, batched with any delivered meanwhile."""
+    name = feed["name"]
+    delivered_signatures.setdefault(name, []).append(signature)
+    task = _save_tasks.get(name)
+    if task is None or task.done():
+        _save_tasks[name] = asyncio.create_task(_save_delivered(feed))
+
+
+async def flush_delivered(feed):
+    """Wait until every signature the feed delivered so far is in its index."""
+    name = feed["name"]
+    task = _save_tasks.get(name)
+    if task is not None and not task.done():
+        # Shielded: a cancelled feed run must not cancel a save other runs rely on.
+        await asyncio.shield(task)
+    if delivered_signatures.get(name):
+        await _save_delivered(feed)
+
+
+# What send_alert returns when no chat's filters want the alert: it is neither saved as
+# sent nor retried, so it goes out again only once the item changes.
+FILTERED = "filtered"
+
+
+async def run_feed(feed, poller, send_alert, queue=None):
+    """Poll one feed once: fetch, enrich, dedup, render and send, as overlapping stages.
+
+    Only items the poller reports as changed enter the pipeline.
+    ``send_alert(record, signature, message)`` returns True once the alert is
+    handed to at least one chat, or FILTERED when every chat filtered it out.
+    With a ``queue`` (an alert_queue.AlertQueue) alerts are pushed there
+    instead and sent by its senders; a failed send makes the item count as
+    changed on a later poll.
+    Signatures of delivered alerts are saved as they are delivered, and any
+    still being saved are waited for before this run reads the index.
+    Returns the number of alerts sent, or queued.
+    """
+    name = feed["name"]
+    await flush_delivered(feed)
+    items = buffered(source_stage(poller), name=(name, "enrich"))
+    records = buffered(enrich_stage(feed, items, poller.forget), name=(name, "dedup"))
+    alerts = buffered(dedup_stage(feed, records), name=(name, "dispatch"))
+    dispatch_seconds = STAGE_SECONDS.labels(name, "dispatch")
+
+    def on_done(record, signature, result):
+        if result == FILTERED:
+            FEED_ITEMS.labels(name, "filtered").inc()
+        elif result:
+            FEED_ITEMS.labels(name, "sent").inc()
+            record_delivered(feed, signature)
+        elif result is False:
+            poller.forget(record["chainId"], record["tokenAddress"])
+
+    count = 0
+    try:
+        async for record, signature, message in alerts:
+            if queue is not None:
+                queue.push(
+                    name, (record["chainId"], record["tokenAddress"]), feed.get("priority", 1),
+                    lambda r=record, s=signature, m=message: send_alert(r, s, m),
+                    lambda result, r=record, s=signature: on_done(r, s, result),
+                )
+                count += 1
+                continue
+            with dispatch_seconds.time():
+                sent = await send_alert(record, signature, message)
+            on_done(record, signature, sent)
+            count += bool(sent) and sent != FILTERED
+        poller.commit()
+    finally:
+        await flush_delivered(feed)
+    return count
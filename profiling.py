@@ -0,0 +1,303 @@
+import asyncio
+import cProfile
+import io
+import linecache
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# How long one profiling request may wait for its cycles before returning what it has.
+PROFILE_TIMEOUT = float(os.environ.get("PROFILE_TIMEOUT", 600))
+# Seconds between two stack samples of the sampling profiler.
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", 0.005))
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", 10))
+
+PROFILE_MODES = ("cprofile", "sample")
+PSTATS_SORTS = ("cumulative", "tottime", "calls", "ncalls", "time")
+
+# Allocations made by the tracing itself are left out of the memory reports.
+MEMORY_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+
+class ProfilerBusy(Exception):
+    """A profiling session is already running."""
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the event loop thread's Python stack from a background thread.
+
+    Counts are kept per stack, root first, and reported in the collapsed
+    format flamegraph.pl and speedscope read ("a;b;c 42").
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileSession:
+    """Profiles from the start of the first watched cycle until ``cycles`` of them have finished.
+
+    Everything the event loop runs in that time is profiled, including the
+    other tasks that interleave with the cycles; that is usually what a slow
+    cycle is waiting behind.
+    """
+
+    def __init__(self, cycles, mode="cprofile", feed=None):
+        self.cycles = cycles
+        self.mode = mode
+        self.feed = feed
+        self.started = 0
+        self.finished = 0
+        self.durations = []
+        self.profile = None
+        self.sampler = None
+        self.began_at = None
+        self.seconds = 0.0
+        self.done = asyncio.Event()
+
+    def wants(self, name):
+        return self.started < self.cycles and self.feed in (None, name)
+
+    def begin(self):
+        if self.started == 0:
+            self.began_at = time.perf_counter()
+            if self.mode == "sample":
+                self.sampler = StackSampler(threading.get_ident())
+                self.sampler.start()
+            else:
+                self.profile = cProfile.Profile()
+                self.profile.enable()
+        self.started += 1
+
+    def end(self, name, seconds):
+        if self.done.is_set():
+            return
+        self.finished += 1
+        self.durations.append((name, seconds))
+        if self.finished >= self.cycles:
+            self.stop()
+
+    def stop(self):
+        if self.done.is_set():
+            return
+        if self.profile is not None:
+            self.profile.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        if self.began_at is not None:
+            self.seconds = time.perf_counter() - self.began_at
+        self.done.set()
+
+    def report(self, sort="cumulative", limit=60):
+        lines = [f"# {self.mode} over {self.finished}/{self.cycles} cycles in {self.seconds:.2f}s"]
+        lines.extend(f"# {name}: {seconds:.3f}s" for name, seconds in self.durations)
+        if self.sampler is not None:
+            lines.append(f"# {self.sampler.samples} samples every {self.sampler.interval * 1000:g}ms")
+            return "\n".join(lines) + "\n" + self.sampler.collapsed()
+        if self.profile is None:
+            return "\n".join(lines) + "\n# no cycle ran\n"
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(limit)
+        return "\n".join(lines) + "\n" + out.getvalue()
+
+
+class MemoryTracker:
+    """tracemalloc snapshots taken at the end of every watched cycle while tracing is on."""
+
+    def __init__(self):
+        self.latest = None
+        self.previous = None
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=TRACEMALLOC_FRAMES):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.latest = self.previous = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self.latest = self.previous = None
+
+    def snapshot(self, label):
+        taken = tracemalloc.take_snapshot().filter_traces(MEMORY_FILTERS)
+        return label, datetime.now().strftime("%H:%M:%S"), taken
+
+    def on_cycle(self, name):
+        self.previous, self.latest = self.latest, self.snapshot(f"after {name} cycle")
+
+    def report(self, key="lineno", limit=25, fresh=False):
+        """Top allocations of the latest snapshot and what changed since the one before."""
+        if not tracemalloc.is_tracing():
+            return None
+        if fresh or self.latest is None:
+            self.previous, self.latest = self.latest, self.snapshot("on request")
+        current, peak = tracemalloc.get_traced_memory()
+        overhead = tracemalloc.get_tracemalloc_memory()
+        lines = [f"# traced {current / 2**20:.1f} MiB, peak {peak / 2**20:.1f} MiB, "
+                 f"{tracemalloc.get_traceback_limit()} frames, tracing overhead {overhead / 2**20:.1f} MiB"]
+        label, taken_at, snapshot = self.latest
+        lines.append(f"\n# top {limit} by {key}, {label} at {taken_at}")
+        lines.extend(format_stat(stat) for stat in snapshot.statistics(key)[:limit])
+        if self.previous is not None:
+            previous_label, previous_at, previous = self.previous
+            lines.append(f"\n# top {limit} changes since {previous_label} at {previous_at}")
+            lines.extend(format_stat(stat) for stat in snapshot.compare_to(previous, key)[:limit])
+        return "\n".join(lines) + "\n"
+
+
+def format_stat(stat):
+    frame = stat.traceback[0]
+    source = linecache.getline(frame.filename, frame.lineno).strip()
+    return f"{stat}\n    {source}" if source else f"{stat}"
+
+
+def coroutine_stack(coro):
+    """Frames of a suspended coroutine down the chain it awaits, and the object at the bottom."""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaited = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+        if awaited is None or not hasattr(awaited, "send"):
+            return frames, awaited
+        coro = awaited
+    return frames, None
+
+
+def dump_tasks():
+    """Every asyncio task with the await chain it is suspended in."""
+    tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+    current = asyncio.current_task()
+    out = [f"# {len(tasks)} tasks"]
+    for task in tasks:
+        coro = task.get_coro()
+        state = "running" if task is current else ("done" if task.done() else "pending")
+        out.append(f"\nTask {task.get_name()!r} {state}: {getattr(coro, '__qualname__', coro)}")
+        frames, awaited = coroutine_stack(coro)
+        for frame in frames:
+            source = linecache.getline(frame.f_code.co_filename, frame.f_lineno).strip()
+            out.append(f'  File "{frame.f_code.co_filename}", line {frame.f_lineno}, in {frame.f_code.co_name}')
+            if source:
+                out.append(f"    {source}")
+        if awaited is not None:
+            out.append(f"  awaiting {awaited!r}")
+    return "\n".join(out) + "\n"
+
+
+class CycleProfiler:
+    """Profiles and memory snapshots around feed cycles, switched on at runtime.
+
+    Feed loops only call ``watch`` while ``watching`` is true, so when
+    nothing was requested a cycle costs one attribute check.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.memory = MemoryTracker()
+        self.watching = False
+
+    def _update(self):
+        self.watching = self.session is not None or self.memory.tracing
+
+    async def watch(self, name, cycle):
+        """Await the ``cycle`` coroutine of feed ``name`` under whatever was requested."""
+        session = self.session
+        if session is not None and session.wants(name):
+            session.begin()
+        else:
+            session = None
+        started = time.perf_counter()
+        try:
+            return await cycle
+        finally:
+            if session is not None:
+                session.end(name, time.perf_counter() - started)
+            if self.memory.tracing:
+                self.memory.on_cycle(name)
+
+    async def profile(self, cycles, mode="cprofile", feed=None, timeout=PROFILE_TIMEOUT):
+        """Profile the next ``cycles`` feed cycles and return the finished session."""
+        if self.session is not None:
+            raise ProfilerBusy("a profile is already running")
+        session = self.session = ProfileSession(cycles, mode, feed)
+        self._update()
+        print(f"🔬 Profiling the next {cycles} {feed or 'feed'} cycles with {mode}")
+        try:
+            await asyncio.wait_for(session.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            session.stop()
+            self.session = None
+            self._update()
+        return session
+
+    def start_tracing(self, frames=TRACEMALLOC_FRAMES):
+        self.memory.start(frames)
+        self._update()
+        print(f"🔬 tracemalloc on ({frames} frames)")
+
+    def stop_tracing(self):
+        self.memory.stop()
+        self._update()
+        print("🔬 tracemalloc off")
+
+    def stats(self):
+        session = self.session
+        return {
+            "profiling": None if session is None else f"{session.mode} {session.finished}/{session.cycles}",
+            "tracing": self.memory.tracing,
+        }
+
+
+cycle_profiler = CycleProfiler()
@@ -0,0 +1,229 @@
+import json
+from typing import Optional, TypedDict, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+Number = Union[int, float]
+
+
+# Only the fields the bot reads. With msgspec installed payloads are decoded against
+# these, so everything else (descriptions, icons, txns, ...) is skipped, not built.
+class LinkJson(TypedDict, total=False):
+    type: Optional[str]
+    label: Optional[str]
+    url: Optional[str]
+
+
+class FeedItemJson(TypedDict, total=False):
+    chainId: Optional[str]
+    tokenAddress: Optional[str]
+    url: Optional[str]
+    header: Optional[str]
+    amount: Optional[Number]
+    totalAmount: Optional[Number]
+    links: Optional[list[LinkJson]]
+
+
+class TokenJson(TypedDict, total=False):
+    address: Optional[str]
+    name: Optional[str]
+    symbol: Optional[str]
+
+
+class WindowJson(TypedDict, total=False):
+    h24: Optional[Number]
+
+
+class LiquidityJson(TypedDict, total=False):
+    usd: Optional[Number]
+
+
+class PairJson(TypedDict, total=False):
+    chainId: Optional[str]
+    baseToken: Optional[TokenJson]
+    quoteToken: Optional[TokenJson]
+    volume: Optional[WindowJson]
+    priceChange: Optional[WindowJson]
+    liquidity: Optional[LiquidityJson]
+    marketCap: Optional[Number]
+    pairCreatedAt: Optional[Number]
+
+
+class PairsJson(TypedDict, total=False):
+    pairs: Optional[list[PairJson]]
+
+
+if msgspec is not None:
+    _feed_decoder = msgspec.json.Decoder(Optional[list[FeedItemJson]])
+    _pairs_decoder = msgspec.json.Decoder(Union[list[PairJson], PairsJson, None])
+else:
+    _feed_decoder = _pairs_decoder = None
+
+
+def _decode(decoder, content):
+    if decoder is not None:
+        try:
+            return decoder.decode(content)
+        except msgspec.ValidationError:
+            # A field with an unexpected type; the generic decoder takes anything.
+            pass
+    return json.loads(content)
+
+
+class FeedItem:
+    """One entry of a token profile, boost or trending feed."""
+
+    __slots__ = ("chainId", "tokenAddress", "url", "header", "amount", "totalAmount", "links")
+
+    def __init__(self, chainId, tokenAddress, url=None, header=None, amount=0, totalAmount=0, links=()):
+        self.chainId = chainId
+        self.tokenAddress = tokenAddress
+        self.url = url
+        self.header = header
+        self.amount = amount
+        self.totalAmount = totalAmount
+        # ((label, url), ...)
+        self.links = links
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f"FeedItem({self.chainId}, {self.tokenAddress})"
+
+
+class PairSnapshot:
+    """The part of a DEX pair the alerts use."""
+
+    __slots__ = ("chainId", "baseAddress", "quoteAddress", "name", "symbol",
+                 "volume", "liquidity", "priceChange", "marketCap", "pairCreatedAt")
+
+    def __init__(self, chainId, baseAddress, quoteAddress, name, symbol,
+                 volume, liquidity, priceChange, marketCap, pairCreatedAt):
+        self.chainId = chainId
+        self.baseAddress = baseAddress
+        self.quoteAddress = quoteAddress
+        self.name = name
+        self.symbol = symbol
+        self.volume = volume
+        self.liquidity = liquidity
+        self.priceChange = priceChange
+        self.marketCap = marketCap
+        self.pairCreatedAt = pairCreatedAt
+
+    def __repr__(self):
+        return f"PairSnapshot({self.chainId}, {self.baseAddress})"
+
+
+class Signature:
+    """What an alert was sent as: a feed's signature fields and their values.
+
+    Reads like the dict it replaces (``sig["chainId"]``, ``dict(sig)``) and
+    compares equal to one with the same items, so signatures loaded from
+    storage as dicts still match. The field names are one tuple shared by
+    every signature of a feed.
+    """
+
+    __slots__ = ("fields", "values_")
+
+    _field_sets = {}
+
+    def __init__(self, fields, values):
+        self.fields = Signature._field_sets.setdefault(fields, fields)
+        self.values_ = tuple(values)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(tuple(data), data.values())
+
+    def __getitem__(self, field):
+        try:
+            return self.values_[self.fields.index(field)]
+        except ValueError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return self.values_[self.fields.index(field)] if field in self.fields else default
+
+    def keys(self):
+        return self.fields
+
+    def values(self):
+        return self.values_
+
+    def items(self):
+        return zip(self.fields, self.values_)
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __eq__(self, other):
+        if isinstance(other, Signature):
+            return self.fields == other.fields and self.values_ == other.values_
+        if isinstance(other, dict):
+            return len(other) == len(self.fields) and all(
+                field in other and other[field] == value for field, value in self.items())
+        return NotImplemented
+
+    def __hash__(self):
+        return hash((self.fields, self.values_))
+
+    def __repr__(self):
+        return f"Signature({dict(self.items())})"
+
+
+def _link(link):
+    label = link.get("label") or (link.get("type") or "Unknown").capitalize()
+    return label, link.get("url") or "No URL"
+
+
+def feed_item(data):
+    """A FeedItem from one decoded feed entry."""
+    return FeedItem(
+        data.get("chainId"),
+        data.get("tokenAddress"),
+        data.get("url"),
+        data.get("header"),
+        data.get("amount") or 0,
+        data.get("totalAmount") or 0,
+        tuple(_link(link) for link in data.get("links") or () if isinstance(link, dict)),
+    )
+
+
+def pair_snapshot(data):
+    """A PairSnapshot from one decoded pair."""
+    base = data.get("baseToken") or {}
+    quote = data.get("quoteToken") or {}
+    return PairSnapshot(
+        data.get("chainId"),
+        base.get("address"),
+        quote.get("address"),
+        # Left empty; each feed has its own placeholder (pipeline.make_record).
+        base.get("name"),
+        base.get("symbol"),
+        (data.get("volume") or {}).get("h24") or 0,
+        (data.get("liquidity") or {}).get("usd") or 0,
+        (data.get("priceChange") or {}).get("h24") or 0,
+        data.get("marketCap") or 0,
+        data.get("pairCreatedAt") or 0,
+    )
+
+
+def decode_feed(content):
+    """FeedItems from a feed response body."""
+    return [feed_item(data) for data in _decode(_feed_decoder, content) or () if isinstance(data, dict)]
+
+
+def decode_pairs(content):
+    """PairSnapshots from a pair lookup body, either a list or {"pairs": [...]}."""
+    data = _decode(_pairs_decoder, content)
+    if isinstance(data, dict):
+        data = data.get("pairs")
+    return [pair_snapshot(pair) for pair in data or () if isinstance(pair, dict)]
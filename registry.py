@@ -0,0 +1,129 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from telegram.error import BadRequest, Forbidden
+
+from funct import load_registered_chats, update_registered_chats
+
+
+load_dotenv()
+
+# Changes are written this many seconds after the first one, together with any that follow.
+REGISTRY_SAVE_DELAY = float(os.environ.get("REGISTRY_SAVE_DELAY", 2))
+# How often a sharded coordinator re-reads the chats (workers evict dead ones in storage).
+REGISTRY_REFRESH_INTERVAL = float(os.environ.get("REGISTRY_REFRESH_INTERVAL", 60))
+
+
+def is_dead_chat_error(error):
+    """True for send errors that mean the chat is gone for good (bot removed, chat deleted)."""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and "chat not found" in str(error).lower()
+
+
+class ChatRegistry:
+    """Registered chats as an in-memory set; storage gets debounced, batched diffs.
+
+    ``add``/``remove`` are O(1) and never touch the disk themselves: the first
+    change schedules a save ``delay`` seconds later that writes every change
+    made meanwhile as one update. ``listeners`` are called on every change.
+    """
+
+    def __init__(self, chat_ids=(), delay=REGISTRY_SAVE_DELAY):
+        self.chats = set(chat_ids)
+        self.delay = delay
+        self.added = set()
+        self.removed = set()
+        self.listeners = []
+        self.save_task = None
+        self.saves = 0
+        self.evicted = 0
+
+    def __contains__(self, chat_id):
+        return chat_id in self.chats
+
+    def __len__(self):
+        return len(self.chats)
+
+    def __iter__(self):
+        return iter(self.chats)
+
+    def add(self, chat_id):
+        """Register a chat; returns False if it already was."""
+        if chat_id in self.chats:
+            return False
+        self.chats.add(chat_id)
+        self.removed.discard(chat_id)
+        self.added.add(chat_id)
+        self._changed()
+        return True
+
+    def remove(self, chat_id):
+        if chat_id not in self.chats:
+            return False
+        self.chats.discard(chat_id)
+        self.added.discard(chat_id)
+        self.removed.add(chat_id)
+        self._changed()
+        return True
+
+    def evict(self, chat_id, reason=None):
+        """Drop a chat Telegram says is gone, so it stops taking dispatch slots.
+
+        The removal is written even for a chat this registry never loaded (a
+        worker only reads the chats at startup), so the coordinator drops it too.
+        """
+        if not self.remove(chat_id):
+            if chat_id in self.removed:
+                return
+            self.removed.add(chat_id)
+            self._changed()
+        self.evicted += 1
+        print(f"🧹 Evicted chat {chat_id}: {reason}")
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
+
+    def _changed(self):
+        self._notify()
+        if self.save_task is None or self.save_task.done():
+            try:
+                self.save_task = asyncio.get_running_loop().create_task(self._save_later())
+            except RuntimeError:
+                # No loop yet; the changes wait for the next flush.
+                pass
+
+    async def _save_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        """Write pending changes now."""
+        while self.added or self.removed:
+            added, removed = self.added, self.removed
+            self.added, self.removed = set(), set()
+            try:
+                await update_registered_chats(added, removed)
+                self.saves += 1
+            except Exception as e:
+                print(f"Error saving registered chats: {e}")
+                self.added |= added - self.removed
+                self.removed |= removed - self.added
+                return
+
+    async def refresh(self):
+        """Re-read the chats from storage, keeping changes not written yet."""
+        stored = await asyncio.to_thread(load_registered_chats)
+        self.chats.clear()
+        self.chats.update((stored | self.added) - self.removed)
+        self._notify()
+
+    def stats(self):
+        return {
+            "chats": len(self.chats),
+            "pending": len(self.added) + len(self.removed),
+            "saves": self.saves,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,338 @@
+"""Offline load test: replay captured DEX traffic against a fake Telegram Bot API.
+
+1. Capture on a live instance (responses go to a timestamped .jsonl.gz):
+       CAPTURE_DIR=captures python bot.py
+2. Replay the capture at 1x or faster against N synthetic chats:
+       python replay.py captures/capture-20260101-120000.jsonl.gz --speed 20 --chats 200 --rate-limit 0.02
+
+The DEX stand-in serves each feed as it looked at that point of the capture,
+answers multi-address pair lookups from every pair seen in the capture and
+serves captured header images. The fake Bot API records every sendPhoto and
+can answer a share of them with 429/retry_after. At the end a JSON report
+gives alert latency percentiles (from an item first appearing in a feed to
+each chat receiving it) and sends per second.
+"""
+import argparse
+import asyncio
+import base64
+import email.parser
+import email.policy
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from http import HTTPStatus
+from urllib.parse import parse_qs, quote, unquote
+
+from server import HttpServer, response
+
+FEED_ENV = {
+    "tokens": "LATEST_TOKEN_PROFILES",
+    "boosts": "LATEST_BOOST",
+    "trends": "TRENDING_TOKENS",
+}
+PLACEHOLDER_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mNkYAAAAAYAAjCB0C8AAAAASUVORK5CYII=")
+
+
+def load_capture(path):
+    meta, responses = {}, []
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["type"] == "meta":
+                meta = record
+            else:
+                record["body"] = base64.b64decode(record["body"])
+                responses.append(record)
+    responses.sort(key=lambda r: r["t"])
+    return meta, responses
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class ReplayClock:
+    """Maps wall time onto capture time, ``speed`` capture seconds per wall second."""
+
+    def __init__(self, t0, speed):
+        self.t0 = t0
+        self.speed = speed
+        self.start = time.monotonic()
+
+    def capture_now(self):
+        return self.t0 + (time.monotonic() - self.start) * self.speed
+
+    def wall_at(self, capture_t):
+        return self.start + (capture_t - self.t0) / self.speed
+
+
+class DexStandIn:
+    """Serves /feed/<name>, /pairs/<a,b,...> and /image?u=<url> from a capture."""
+
+    def __init__(self, meta, responses, clock):
+        self.clock = clock
+        self.base_url = None
+        self.feeds = defaultdict(list)
+        self.pairs = defaultdict(list)
+        self.images = {}
+        self.first_seen = {}
+        self.requests = defaultdict(int)
+
+        env = meta.get("env", {})
+        feed_urls = {env[var]: name for name, var in FEED_ENV.items() if env.get(var)}
+        pairs_url = env.get("TOKEN_PROFILE_NAMES") or ""
+        for r in responses:
+            base = r["url"].split("?")[0]
+            if base in feed_urls and r["status"] == 200:
+                items = json.loads(r["body"])
+                self.feeds[feed_urls[base]].append((r["t"], items))
+                for item in items:
+                    self.first_seen.setdefault(item.get("tokenAddress"), r["t"])
+            elif pairs_url and base.startswith(pairs_url + "/") and r["status"] == 200:
+                data = json.loads(r["body"])
+                for pair in (data.get("pairs") or [] if isinstance(data, dict) else data or []):
+                    address = str((pair.get("baseToken") or {}).get("address", "")).lower()
+                    self.pairs[address].append((r["t"], pair))
+            elif r["status"] == 200:
+                self.images[r["url"]] = r["body"]
+
+    def _at(self, timeline):
+        now = self.clock.capture_now()
+        current = timeline[0][1]
+        for t, value in timeline:
+            if t > now:
+                break
+            current = value
+        return current
+
+    def _localise(self, items):
+        items = [dict(item) for item in items]
+        for item in items:
+            if item.get("header"):
+                item["header"] = f"{self.base_url}/image?u={quote(item['header'], safe='')}"
+        return items
+
+    async def handle(self, request):
+        self.requests[request.path.split("/")[1] if "/" in request.path else request.path] += 1
+        if request.path.startswith("/feed/"):
+            timeline = self.feeds.get(request.path[len("/feed/"):])
+            body = json.dumps(self._localise(self._at(timeline)) if timeline else []).encode()
+            etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+            if request.headers.get("if-none-match") == etag:
+                return HTTPStatus.NOT_MODIFIED, {"ETag": etag}, b""
+            return HTTPStatus.OK, {"Content-Type": "application/json", "ETag": etag}, body
+        if request.path.startswith("/pairs/"):
+            pairs = []
+            for address in unquote(request.path[len("/pairs/"):]).split(","):
+                timeline = self.pairs.get(address.lower())
+                if timeline:
+                    pairs.append(self._at(timeline))
+            return response(HTTPStatus.OK, json.dumps({"pairs": pairs}), "application/json")
+        if request.path == "/image":
+            return HTTPStatus.OK, {"Content-Type": "image/png"}, self.images.get(request.query.get("u"), PLACEHOLDER_PNG)
+        return response(HTTPStatus.NOT_FOUND, "not found")
+
+
+class FakeBotApi:
+    """Answers the Bot API calls the checker makes and records every sendPhoto."""
+
+    def __init__(self, rate_limit=0.0, retry_after=1, seed=7):
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.sends = []
+        self.edits = 0
+        self.injected_429 = 0
+        self.message_ids = defaultdict(int)
+        self.sends_by_bot = defaultdict(int)
+
+    @staticmethod
+    def parse_params(request):
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(request.body or b"{}")
+        if content_type.startswith("multipart/form-data"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + request.body)
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename() is None:
+                    params[name] = part.get_content()
+            return params
+        return {key: values[-1] for key, values in parse_qs(request.body.decode()).items()}
+
+    def message(self, chat_id, caption=None):
+        chat_id = int(chat_id)
+        self.message_ids[chat_id] += 1
+        return {
+            "message_id": self.message_ids[chat_id],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel", "title": f"replay {chat_id}"},
+            "caption": caption,
+            "photo": [{"file_id": "replay-photo", "file_unique_id": "replay-photo", "width": 1, "height": 1}],
+        }
+
+    async def handle(self, request):
+        method = request.path.rsplit("/", 1)[-1]
+        params = self.parse_params(request)
+
+        def ok(result):
+            return response(HTTPStatus.OK, json.dumps({"ok": True, "result": result}), "application/json")
+
+        if method == "getMe":
+            return ok({"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"})
+        if method in ("sendPhoto", "editMessageCaption", "sendMessage"):
+            if self.rate_limit and self.rng.random() < self.rate_limit:
+                self.injected_429 += 1
+                return response(HTTPStatus.TOO_MANY_REQUESTS, json.dumps({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }), "application/json")
+            if method == "sendPhoto":
+                self.sends.append((time.monotonic(), int(params["chat_id"]), params.get("caption", "")))
+                # The path is /bot<token>/sendPhoto; the bot ID is the part of the token before the colon.
+                self.sends_by_bot[request.path.rsplit("/", 2)[-2][len("bot"):].split(":")[0]] += 1
+            elif method == "editMessageCaption":
+                self.edits += 1
+            return ok(self.message(params["chat_id"], params.get("caption")))
+        return ok(True)
+
+
+def configure_environment(port, speed, overrides):
+    base = f"http://127.0.0.1:{port}"
+    for name, var in FEED_ENV.items():
+        os.environ[var] = f"{base}/feed/{name}"
+    os.environ["TOKEN_PROFILE_NAMES"] = f"{base}/pairs"
+    os.environ.pop("CAPTURE_DIR", None)
+    os.environ["STORAGE_BACKEND"] = "json"
+    # Scale the poll and retry timing with the replay speed unless set explicitly.
+    for var, default in (("POLL_INTERVAL", 60), ("POLL_MIN_INTERVAL", 10), ("POLL_MAX_INTERVAL", 300),
+                         ("OUTBOX_RETRY_INTERVAL", 10), ("OUTBOX_BASE_BACKOFF", 15)):
+        os.environ.setdefault(var, str(default / speed))
+    os.environ.update(overrides)
+
+
+async def replay(args):
+    meta, responses = load_capture(args.capture)
+    if not responses:
+        sys.exit("capture has no responses")
+    t0, t_end = responses[0]["t"], responses[-1]["t"]
+    duration = args.duration or (t_end - t0) / args.speed + args.drain
+
+    clock = ReplayClock(t0, args.speed)
+    dex = DexStandIn(meta, responses, clock)
+    fake_bot = FakeBotApi(args.rate_limit, args.retry_after)
+    server = HttpServer("127.0.0.1", 0)
+
+    async def route(request):
+        if request.path.startswith("/bot"):
+            return await fake_bot.handle(request)
+        return await dex.handle(request)
+
+    server.fallback = route
+    await server.start()
+    dex.base_url = f"http://127.0.0.1:{server.port}"
+
+    overrides = {}
+    if args.global_rate:
+        overrides["TELEGRAM_GLOBAL_RATE"] = str(args.global_rate)
+    if args.chat_rate:
+        overrides["TELEGRAM_CHAT_RATE"] = str(args.chat_rate)
+    configure_environment(server.port, args.speed, overrides)
+
+    # Imported only now: these modules read their configuration from the environment at import.
+    from telegram import Bot
+    import check
+    from outbox import run_outbox_loop
+    from alert_queue import run_alert_senders
+    from botpool import bot_pool
+    from dispatch import dispatcher
+    from http_client import close_client
+
+    for i in range(args.chats):
+        check.registry.add(-1_000_000_000_000 - i)
+    bots = [Bot(f"{i}:replay", base_url=f"{dex.base_url}/bot", base_file_url=f"{dex.base_url}/file/bot")
+            for i in range(max(1, args.bots))]
+    for i, bot in enumerate(bots):
+        await bot.initialize()
+        bot_pool.add(bot, dispatcher if i == 0 else None)
+
+    print(f"▶️ Replaying {len(responses)} responses ({t_end - t0:.0f}s captured) at {args.speed}x "
+          f"to {args.chats} chats for {duration:.0f}s", file=sys.stderr)
+    started = time.monotonic()
+    tasks = [asyncio.create_task(check.run_feed_loop(name, bot_pool)) for name in check.FEEDS]
+    tasks.append(asyncio.create_task(run_alert_senders()))
+    tasks.append(asyncio.create_task(run_outbox_loop(bot_pool)))
+    await asyncio.sleep(duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    elapsed = time.monotonic() - started
+    for bot in bots:
+        await bot.shutdown()
+    await close_client()
+    await server.stop()
+
+    latencies = []
+    address_pattern = re.compile(r"<code>([^<]+)</code>")
+    for sent_at, _, caption in fake_bot.sends:
+        match = address_pattern.search(caption)
+        if match and match.group(1) in dex.first_seen:
+            latencies.append(max(0.0, sent_at - clock.wall_at(dex.first_seen[match.group(1)])))
+
+    return {
+        "capture": args.capture,
+        "speed": args.speed,
+        "chats": args.chats,
+        "wall_seconds": round(elapsed, 3),
+        "sends": len(fake_bot.sends),
+        "sends_per_sec": round(len(fake_bot.sends) / elapsed, 2) if elapsed else None,
+        "edits": fake_bot.edits,
+        "alerts": len({caption for _, _, caption in fake_bot.sends}),
+        "injected_429": fake_bot.injected_429,
+        "sends_by_bot": dict(fake_bot.sends_by_bot),
+        "upstream_requests": dict(dex.requests),
+        # Wall-clock seconds; multiply by speed for the equivalent live latency.
+        "latency": {
+            f"p{p}": percentile(latencies, p) for p in (50, 90, 95, 99)
+        } | {"max": max(latencies) if latencies else None, "samples": len(latencies)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="capture-*.jsonl.gz written with CAPTURE_DIR")
+    parser.add_argument("--speed", type=float, default=1.0, help="capture seconds per wall second")
+    parser.add_argument("--chats", type=int, default=50, help="number of synthetic registered chats")
+    parser.add_argument("--bots", type=int, default=1, help="number of bot tokens in the send pool")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after of injected 429s")
+    parser.add_argument("--duration", type=float, help="wall seconds to run (default: capture span / speed + drain)")
+    parser.add_argument("--drain", type=float, default=30, help="extra wall seconds after the capture ends")
+    parser.add_argument("--global-rate", type=float, help="override TELEGRAM_GLOBAL_RATE")
+    parser.add_argument("--chat-rate", type=float, help="override TELEGRAM_CHAT_RATE")
+    args = parser.parse_args()
+    args.capture = os.path.abspath(args.capture)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Sent-history, outbox and chat files live in a throwaway directory.
+        os.chdir(tmp)
+        report = asyncio.run(replay(args))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
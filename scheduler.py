@@ -0,0 +1,166 @@
+import hashlib
+import os
+import time
+
+from dotenv import load_dotenv
+
+import upstream
+from metrics import FEED_ITEMS, RATE_LIMITED, UPSTREAM_ERRORS
+from records import decode_feed
+
+
+load_dotenv()
+
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", 60))
+POLL_MIN_INTERVAL = float(os.environ.get("POLL_MIN_INTERVAL", 10))
+POLL_MAX_INTERVAL = float(os.environ.get("POLL_MAX_INTERVAL", 300))
+# Interval multipliers: new items -> speed up, nothing new -> slow down, 429/5xx -> back off.
+POLL_SPEEDUP = float(os.environ.get("POLL_SPEEDUP", 0.7))
+POLL_SLOWDOWN = float(os.environ.get("POLL_SLOWDOWN", 1.25))
+POLL_BACKOFF = float(os.environ.get("POLL_BACKOFF", 2.0))
+
+
+class UpstreamBusy(Exception):
+    """The feed answered 429 or 5xx; retry_after is the server's hint in seconds, if any."""
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"upstream returned {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def item_hash(item):
+    # Over the decoded fields only: a change to a field the bot never reads is no change.
+    return digest(repr(item.astuple()).encode())
+
+
+def item_key(item):
+    return (item.chainId, item.tokenAddress)
+
+
+class FeedPoller:
+    """Polling state for one feed: conditional-request validators, change detection and interval.
+
+    ``fetch`` returns only the items whose raw JSON changed since the last
+    completed poll, and nothing at all when the server answers 304 or the
+    body hash is unchanged. New validators and hashes take effect only on
+    ``commit``, so a poll that crashes half way is retried in full.
+    """
+
+    def __init__(self, name, url, interval=POLL_INTERVAL,
+                 min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+        self.name = name
+        self.url = url
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.etag = None
+        self.last_modified = None
+        self.body_hash = None
+        self.seen = {}
+        self.pending = None
+        self.changed = 0
+        self.polls = 0
+        self.not_modified = 0
+        self.unchanged_items = 0
+        self.last_poll = None
+
+    async def fetch(self):
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        self.polls += 1
+        self.changed = 0
+        self.last_poll = time.time()
+        response = await upstream.get("feed", self.url, headers=headers)
+        if response.status_code == 304:
+            self.not_modified += 1
+            self.pending = None
+            return []
+        if response.status_code == 429 or response.status_code >= 500:
+            UPSTREAM_ERRORS.labels("feed", str(response.status_code)).inc()
+            if response.status_code == 429:
+                RATE_LIMITED.labels("upstream").inc()
+            retry_after = response.headers.get("Retry-After", "")
+            raise UpstreamBusy(response.status_code, float(retry_after) if retry_after.isdigit() else None)
+        response.raise_for_status()
+
+        body_hash = digest(response.content)
+        if body_hash == self.body_hash:
+            # Same body as the last committed poll, so its validators are safe to keep.
+            self.etag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            self.not_modified += 1
+            self.pending = None
+            return []
+
+        seen = {}
+        changed = []
+        unchanged = 0
+        for item in decode_feed(response.content):
+            key, raw = item_key(item), item_hash(item)
+            seen.setdefault(key, set()).add(raw)
+            if raw in self.seen.get(key, ()):
+                unchanged += 1
+                continue
+            changed.append(item)
+        self.unchanged_items += unchanged
+        FEED_ITEMS.labels(self.name, "unchanged").inc(unchanged)
+
+        self.changed = len(changed)
+        self.pending = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "body_hash": body_hash,
+            "seen": seen,
+        }
+        return changed
+
+    def forget(self, chain_id, token_address):
+        """Make an item count as changed next poll (e.g. its send failed)."""
+        if self.pending is not None:
+            self.pending["seen"].pop((chain_id, token_address), None)
+            # The body must be re-parsed for the item to come back.
+            self.pending["etag"] = self.pending["last_modified"] = self.pending["body_hash"] = None
+        else:
+            # A queued send can fail after its poll was committed.
+            self.seen.pop((chain_id, token_address), None)
+            self.etag = self.last_modified = self.body_hash = None
+
+    def commit(self):
+        if self.pending is not None:
+            self.etag = self.pending["etag"]
+            self.last_modified = self.pending["last_modified"]
+            self.body_hash = self.pending["body_hash"]
+            self.seen = self.pending["seen"]
+            self.pending = None
+
+    def _clamp(self, interval):
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def on_success(self):
+        factor = POLL_SPEEDUP if self.changed else POLL_SLOWDOWN
+        self.interval = self._clamp(self.interval * factor)
+        return self.interval
+
+    def on_error(self, error):
+        self.interval = self._clamp(self.interval * POLL_BACKOFF)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            return max(self.interval, retry_after)
+        return self.interval
+
+    def stats(self):
+        return {
+            "interval": round(self.interval, 1),
+            "polls": self.polls,
+            "not_modified": self.not_modified,
+            "unchanged_items": self.unchanged_items,
+        }
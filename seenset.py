@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# Starting slots per table; it doubles whenever it gets SEEN_LOAD_FACTOR full.
+SEEN_INITIAL_CAPACITY = int(os.environ.get("SEEN_INITIAL_CAPACITY", 1 << 16))
+SEEN_LOAD_FACTOR = float(os.environ.get("SEEN_LOAD_FACTOR", 0.7))
+# Past this many tokens the oldest half is dropped instead of growing further.
+SEEN_MAX_ENTRIES = int(os.environ.get("SEEN_MAX_ENTRIES", 4_000_000))
+BLOOM_HASHES = 4
+
+MAGIC = b"DXSEEN02"
+# magic, capacity, count, then padding up to a 64-byte header.
+HEADER = struct.Struct("<8sQQ40x")
+# Each slot is a 64-bit token key, a 64-bit signature hash and a 32-bit timestamp,
+# plus one byte (8 bits) of Bloom filter: 21 bytes per slot.
+SLOT_BYTES = 8 + 8 + 4 + 1
+
+
+HASH = struct.Struct("<Q")
+
+
+def hash64(data):
+    value = HASH.unpack(hashlib.blake2b(data, digest_size=8).digest())[0]
+    # 0 marks an empty slot.
+    return value or 1
+
+
+def key_hash(chain_id, token_address):
+    return hash64(f"{chain_id}\x00{token_address}".encode())
+
+
+def signature_hash(signature):
+    # Every signature of one history has the same fields in the feed's order, so the
+    # values alone identify it; joining them is several times cheaper than a sorted JSON dump.
+    return hash64("\x1f".join(map(str, signature.values())).encode())
+
+
+def file_size(capacity):
+    return HEADER.size + capacity * SLOT_BYTES
+
+
+class SeenSet:
+    """Sent signatures as fixed-width hashes, for "was this exact signature sent?".
+
+    One entry per (chainId, tokenAddress) holds a 64-bit hash of the token key,
+    a 64-bit hash of its last sent signature and when it was sent, in an
+    open-addressed table (linear probing) of three flat arrays. A Bloom filter
+    over the token keys answers most lookups of new tokens without probing.
+
+    With a ``path`` the arrays live in a memory-mapped file, so opening is
+    instant and writes need no serialisation; without one they are in memory.
+    Drop-in for funct.DedupIndex, except that it cannot give the signatures back.
+    """
+
+    def __init__(self, path=None, capacity=SEEN_INITIAL_CAPACITY, ttl=0, max_entries=SEEN_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.mm = None
+        self.views = ()
+        self.lookups = 0
+        self.bloom_negatives = 0
+        self.rebuilds = 0
+        if path is not None and os.path.exists(path):
+            self._map_file(path)
+        else:
+            self._create(max(8, 1 << (capacity - 1).bit_length()))
+
+    # --------------- layout ---------------
+
+    def _create(self, capacity, entries=()):
+        """Start a new table of ``capacity`` slots holding ``entries`` (key, sig, stamp)."""
+        self._release()
+        buffer = bytearray(file_size(capacity))
+        self._attach(buffer, capacity, 0)
+        for key, sig, stamp in entries:
+            self._insert(key, sig, stamp)
+        HEADER.pack_into(buffer, 0, MAGIC, capacity, self.count)
+        if self.path is not None:
+            self._release()
+            self._write_file(buffer)
+            self._map_file(self.path)
+
+    def _write_file(self, buffer):
+        # Written aside and swapped in, so a crash leaves the old table intact.
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(buffer)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def _map_file(self, path):
+        self._release()
+        with open(path, "r+b") as f:
+            mm = mmap.mmap(f.fileno(), 0)
+        magic, capacity, count = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or len(mm) != file_size(capacity):
+            mm.close()
+            raise ValueError(f"{path} is not a seen-set file")
+        self.mm = mm
+        self._attach(mm, capacity, count)
+
+    def _attach(self, buffer, capacity, count):
+        self.buffer = buffer
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.count = count
+        view = memoryview(buffer)
+        offset = HEADER.size
+        self.keys = view[offset:offset + 8 * capacity].cast("Q")
+        offset += 8 * capacity
+        self.sigs = view[offset:offset + 8 * capacity].cast("Q")
+        offset += 8 * capacity
+        self.stamps = view[offset:offset + 4 * capacity].cast("I")
+        offset += 4 * capacity
+        self.bloom = view[offset:offset + capacity]
+        self.bloom_mask = capacity * 8 - 1
+        self.views = (view, self.keys, self.sigs, self.stamps, self.bloom)
+
+    def _release(self):
+        for view in self.views:
+            view.release()
+        self.views = ()
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    # --------------- table ---------------
+
+    def _bloom_bits(self, key):
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        return [(h1 + i * h2) & self.bloom_mask for i in range(BLOOM_HASHES)]
+
+    def _slot(self, key):
+        """The slot holding ``key``, or the empty slot where it would go."""
+        keys, mask = self.keys, self.mask
+        i = key & mask
+        while True:
+            found = keys[i]
+            if found == key or found == 0:
+                return i
+            i = (i + 1) & mask
+
+    def _insert(self, key, sig, stamp):
+        i = self._slot(key)
+        if self.keys[i] == 0:
+            self.keys[i] = key
+            self.count += 1
+            for bit in self._bloom_bits(key):
+                self.bloom[bit >> 3] |= 1 << (bit & 7)
+        self.sigs[i] = sig
+        self.stamps[i] = stamp
+
+    def _live(self, now):
+        cutoff = now - self.ttl if self.ttl else 0
+        keys, sigs, stamps = self.keys, self.sigs, self.stamps
+        return [(keys[i], sigs[i], stamps[i]) for i in range(self.capacity) if keys[i] and stamps[i] >= cutoff]
+
+    def _rebuilt(self, now, extra=1):
+        """A new table with room for ``extra`` more entries: grown, or once at max_entries
+        holding only the newest half. Only reads this one, so it can run in a thread
+        while lookups go on; with a path the new file is already in place.
+        """
+        entries = self._live(now)
+        capacity = self.capacity
+        if len(entries) + extra > self.max_entries:
+            entries.sort(key=lambda entry: entry[2])
+            entries = entries[len(entries) // 2:]
+        while len(entries) + extra > capacity * SEEN_LOAD_FACTOR:
+            capacity *= 2
+        table = SeenSet(capacity=capacity, ttl=self.ttl, max_entries=self.max_entries)
+        for key, sig, stamp in entries:
+            table._insert(key, sig, stamp)
+        HEADER.pack_into(table.buffer, 0, MAGIC, table.capacity, table.count)
+        if self.path is not None:
+            # The old file stays mapped (and readable) until _swap.
+            self._write_file(table.buffer)
+        return table
+
+    def _swap(self, table):
+        if self.path is not None:
+            self._map_file(self.path)
+        else:
+            self._release()
+            self._attach(table.buffer, table.capacity, table.count)
+        self.rebuilds += 1
+
+    def needs_rebuild(self, extra=1):
+        return self.count + extra > min(self.capacity * SEEN_LOAD_FACTOR, self.max_entries)
+
+    async def reserve(self, extra):
+        """Make room for ``extra`` new entries, rebuilding the table in a thread.
+
+        Callers must not upsert concurrently; lookups are fine.
+        """
+        if self.needs_rebuild(extra):
+            self._swap(await asyncio.to_thread(self._rebuilt, time.time(), extra))
+
+    # --------------- DedupIndex interface ---------------
+
+    def _find(self, signature):
+        """The slot of this token's live entry, or None."""
+        self.lookups += 1
+        key = key_hash(signature["chainId"], signature["tokenAddress"])
+        bloom, bloom_mask = self.bloom, self.bloom_mask
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        for i in range(BLOOM_HASHES):
+            bit = (h1 + i * h2) & bloom_mask
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                self.bloom_negatives += 1
+                return None
+        i = self._slot(key)
+        if self.keys[i] == 0:
+            return None
+        if self.ttl and self.stamps[i] < time.time() - self.ttl:
+            return None
+        return i
+
+    def is_sent(self, signature):
+        i = self._find(signature)
+        return i is not None and self.sigs[i] == signature_hash(signature)
+
+    def upsert(self, signature):
+        """Add or replace the entry for this token; True if anything changed."""
+        if self.is_sent(signature):
+            return False
+        now = time.time()
+        key = key_hash(signature["chainId"], signature["tokenAddress"])
+        if self.keys[self._slot(key)] == 0 and self.needs_rebuild():
+            # Normally reserve() made room beforehand, off the event loop.
+            self._swap(self._rebuilt(now))
+        self._insert(key, signature_hash(signature), int(now))
+        HEADER.pack_into(self.buffer, 0, MAGIC, self.capacity, self.count)
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, signature):
+        return self._find(signature) is not None
+
+    def flush(self):
+        """Push changes to disk now (the OS writes them back eventually anyway)."""
+        if self.mm is not None:
+            self.mm.flush()
+
+    def close(self):
+        self.flush()
+        self._release()
+
+    def stats(self):
+        return {
+            "entries": self.count,
+            "capacity": self.capacity,
+            "bytes": file_size(self.capacity),
+            "lookups": self.lookups,
+            "bloom_negatives": self.bloom_negatives,
+            "rebuilds": self.rebuilds,
+        }
+
+
+def open_seen_set(path, load_signatures, ttl=0):
+    """Map the seen-set at ``path``, importing ``load_signatures()`` into it the first time.
+
+    A file from another version is rebuilt from the signatures as well.
+    """
+    if os.path.exists(path):
+        try:
+            return SeenSet(path, ttl=ttl)
+        except ValueError as e:
+            print(f"⚠️ {e}, rebuilding it from storage")
+            os.remove(path)
+    signatures = load_signatures()
+    seen = SeenSet(path, capacity=int(len(signatures) / SEEN_LOAD_FACTOR) + 1, ttl=ttl)
+    for signature in signatures:
+        seen.upsert(signature)
+    seen.flush()
+    return seen
@@ -0,0 +1,261 @@
+import asyncio
+import hmac
+import json
+import os
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from dotenv import load_dotenv
+from telegram import Update
+
+from metrics import render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from profiling import PROFILE_MODES, PSTATS_SORTS, TRACEMALLOC_FRAMES, ProfilerBusy, cycle_profiler, dump_tasks
+
+
+load_dotenv()
+
+HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 8080))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+MAX_BODY_SIZE = int(os.environ.get("HTTP_MAX_BODY_SIZE", 1024 * 1024))
+KEEPALIVE_TIMEOUT = float(os.environ.get("HTTP_KEEPALIVE_TIMEOUT", 15))
+# The /admin routes (profiling, memory, task dumps) only exist when this is set;
+# requests must send it in the X-Admin-Secret header.
+ADMIN_SECRET = os.environ.get("ADMIN_SECRET", "")
+ADMIN_PATH = os.environ.get("ADMIN_PATH", "/admin").rstrip("/")
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method, target, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+        self.headers = headers
+        self.body = body
+
+
+def response(status, body=b"", content_type="text/plain; charset=utf-8"):
+    if isinstance(body, str):
+        body = body.encode()
+    return status, {"Content-Type": content_type}, body
+
+
+class HttpServer:
+    """Minimal HTTP/1.1 server on the bot's own event loop.
+
+    Handlers are coroutines registered per (method, path) that take a
+    Request and return (status, headers, body); ``fallback``, if set,
+    gets every request no route matches. It only has to serve the
+    health check, /metrics and the Telegram webhook, so there is no
+    chunked encoding, no TLS (put it behind the platform's proxy) and
+    bodies are capped at HTTP_MAX_BODY_SIZE.
+    """
+
+    def __init__(self, host=HTTP_HOST, port=PORT):
+        self.host = host
+        self.port = port
+        self.routes = {}
+        self.fallback = None
+        self.server = None
+        self.connections = {}
+
+    def route(self, method, path, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        # Port 0 asks the OS for a free port; report the real one.
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"🌐 HTTP server listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            # Idle keep-alive connections would otherwise linger until their timeout.
+            for writer in list(self.connections):
+                writer.close()
+            if self.connections:
+                await asyncio.wait(list(self.connections.values()), timeout=1)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _read_request(self, reader):
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+        lines = head.decode("latin-1").split("\r\n")
+        method, target, version = lines[0].split(" ", 2)
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                key, value = line.split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0) or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        return Request(method, target, headers, body), keep_alive
+
+    async def _dispatch(self, request):
+        handler = self.routes.get((request.method, request.path), self.fallback)
+        if handler is None:
+            if any(path == request.path for _, path in self.routes):
+                return response(HTTPStatus.METHOD_NOT_ALLOWED, "method not allowed")
+            return response(HTTPStatus.NOT_FOUND, "not found")
+        try:
+            return await handler(request)
+        except Exception as e:
+            print(f"Error handling {request.method} {request.path}: {e}")
+            return response(HTTPStatus.INTERNAL_SERVER_ERROR, "internal error")
+
+    async def _handle_connection(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                try:
+                    request, keep_alive = await self._read_request(reader)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except (ValueError, asyncio.LimitOverrunError):
+                    await self._write(writer, response(HTTPStatus.BAD_REQUEST, "bad request"), False)
+                    break
+
+                await self._write(writer, await self._dispatch(request), keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            self.connections.pop(writer, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _write(self, writer, result, keep_alive):
+        status, headers, body = result
+        status = HTTPStatus(status)
+        head = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        headers = dict(headers)
+        headers["Content-Length"] = str(len(body))
+        headers["Connection"] = "keep-alive" if keep_alive else "close"
+        head.extend(f"{key}: {value}" for key, value in headers.items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+# =================== ROUTES ===================
+
+async def health(request):
+    return response(HTTPStatus.OK, "✅ Telegram bot is running!")
+
+
+async def metrics(request):
+    return response(HTTPStatus.OK, render_metrics(), METRICS_CONTENT_TYPE)
+
+
+def webhook_handler(app, secret=WEBHOOK_SECRET, accepting=None):
+    """Verify Telegram's secret-token header and hand the update to the application.
+
+    While ``accepting()`` is false (a standby coordinator) updates get a 503,
+    so Telegram retries them until the active instance answers.
+    """
+
+    async def webhook(request):
+        token = request.headers.get("x-telegram-bot-api-secret-token", "")
+        if not hmac.compare_digest(token.encode(), secret.encode()):
+            return response(HTTPStatus.FORBIDDEN, "forbidden")
+        if accepting is not None and not accepting():
+            return response(HTTPStatus.SERVICE_UNAVAILABLE, "standby")
+        try:
+            update = Update.de_json(json.loads(request.body), app.bot)
+        except ValueError:
+            return response(HTTPStatus.BAD_REQUEST, "bad update")
+        await app.update_queue.put(update)
+        return response(HTTPStatus.OK, "ok")
+
+    return webhook
+
+
+def admin_only(handler, secret=ADMIN_SECRET):
+    """Wrap an admin handler: check the X-Admin-Secret header and turn bad parameters into a 400."""
+
+    async def guarded(request):
+        token = request.headers.get("x-admin-secret", "")
+        if not hmac.compare_digest(token.encode(), secret.encode()):
+            return response(HTTPStatus.FORBIDDEN, "forbidden")
+        try:
+            return await handler(request)
+        except ValueError as e:
+            return response(HTTPStatus.BAD_REQUEST, f"bad request: {e}")
+
+    return guarded
+
+
+def choice(request, name, choices):
+    value = request.query.get(name, choices[0])
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(choices)}")
+    return value
+
+
+async def admin_profile(request):
+    """Profile the next ``cycles`` feed cycles (optionally of one ``feed``) and return the result.
+
+    ``mode=cprofile`` gives pstats text sorted by ``sort``; ``mode=sample``
+    gives sampled stacks in collapsed (flamegraph) format.
+    """
+    cycles = int(request.query.get("cycles", 1))
+    if cycles < 1:
+        raise ValueError("cycles must be at least 1")
+    mode = choice(request, "mode", PROFILE_MODES)
+    sort = choice(request, "sort", PSTATS_SORTS)
+    limit = int(request.query.get("limit", 60))
+    try:
+        session = await cycle_profiler.profile(cycles, mode, request.query.get("feed"))
+    except ProfilerBusy as e:
+        return response(HTTPStatus.CONFLICT, str(e))
+    return response(HTTPStatus.OK, session.report(sort, limit))
+
+
+async def admin_memory(request):
+    """Top allocations at the end of the last cycle and the diff to the cycle before."""
+    report = cycle_profiler.memory.report(
+        choice(request, "key", ("lineno", "filename", "traceback")),
+        int(request.query.get("limit", 25)),
+        fresh="fresh" in request.query,
+    )
+    if report is None:
+        return response(HTTPStatus.CONFLICT, f"tracemalloc is off; POST {ADMIN_PATH}/memory/start first")
+    return response(HTTPStatus.OK, report)
+
+
+async def admin_memory_start(request):
+    cycle_profiler.start_tracing(int(request.query.get("frames", TRACEMALLOC_FRAMES)))
+    return response(HTTPStatus.OK, "tracing")
+
+
+async def admin_memory_stop(request):
+    cycle_profiler.stop_tracing()
+    return response(HTTPStatus.OK, "stopped")
+
+
+async def admin_tasks(request):
+    return response(HTTPStatus.OK, dump_tasks())
+
+
+def build_server(app=None, webhook=False, accepting=None, port=PORT):
+    server = HttpServer(port=port)
+    server.route("GET", "/", health)
+    server.route("GET", "/metrics", metrics)
+    if webhook:
+        server.route("POST", WEBHOOK_PATH, webhook_handler(app, accepting=accepting))
+    if ADMIN_SECRET:
+        server.route("POST", f"{ADMIN_PATH}/profile", admin_only(admin_profile))
+        server.route("GET", f"{ADMIN_PATH}/memory", admin_only(admin_memory))
+        server.route("POST", f"{ADMIN_PATH}/memory/start", admin_only(admin_memory_start))
+        server.route("POST", f"{ADMIN_PATH}/memory/stop", admin_only(admin_memory_stop))
+        server.route("GET", f"{ADMIN_PATH}/tasks", admin_only(admin_tasks))
+    return server
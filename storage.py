@@ -0,0 +1,264 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+# "json" keeps the original one-file-per-history layout; "sqlite" uses one WAL database.
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "dexmonitor.db")
+SUBSCRIPTIONS_FILE = os.environ.get("SUBSCRIPTIONS_FILE", "subscriptions.json")
+
+
+class JsonStorage:
+    """The original layout: every history is a JSON list rewritten on save.
+
+    Writes go to a temporary file that is renamed over the old one, so a
+    kill mid-write leaves the previous file intact.
+    """
+
+    def __init__(self, files, chat_file, subscription_file=SUBSCRIPTIONS_FILE, max_size=None):
+        self.files = files
+        self.chat_file = chat_file
+        self.subscription_file = subscription_file
+        self.max_size = max_size
+
+    def _read(self, path, default):
+        if not os.path.exists(path):
+            return default
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            print(f"⚠️ Warning: Corrupted {path}. Resetting.")
+            return default
+
+    def _write(self, path, data, **kwargs):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, **kwargs)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def sent_file(self, kind):
+        # The three original histories keep their file names; any other kind gets sent_<kind>.json.
+        return self.files.get(kind) or f"sent_{kind}.json"
+
+    def load_signatures(self, kind):
+        return self._read(self.sent_file(kind), [])
+
+    def save_signatures(self, kind, new_signatures, all_signatures=None):
+        if all_signatures is None:
+            # Only the new ones are known: merge them into the file, replacing older
+            # entries of the same token and keeping the newest max_size.
+            merged = {(sig["chainId"], sig["tokenAddress"]): sig for sig in self.load_signatures(kind)}
+            for sig in new_signatures:
+                key = (sig["chainId"], sig["tokenAddress"])
+                merged.pop(key, None)
+                merged[key] = sig
+            all_signatures = list(merged.values())
+            if self.max_size:
+                all_signatures = all_signatures[-self.max_size:]
+        # dict() also turns records.Signature into the plain object the file has always held.
+        self._write(self.sent_file(kind), [dict(sig) for sig in all_signatures], indent=2)
+
+    def load_chats(self):
+        return set(self._read(self.chat_file, []))
+
+    def save_chats(self, chat_ids):
+        self._write(self.chat_file, list(chat_ids))
+
+    def update_chats(self, added, removed):
+        self.save_chats((self.load_chats() | added) - removed)
+
+    def load_subscriptions(self):
+        return {int(chat_id): settings for chat_id, settings in self._read(self.subscription_file, {}).items()}
+
+    def save_subscription(self, chat_id, settings):
+        subscriptions = self.load_subscriptions()
+        if settings:
+            subscriptions[chat_id] = settings
+        else:
+            subscriptions.pop(chat_id, None)
+        self._write(self.subscription_file, subscriptions, indent=2)
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """Sent-history and registered chats in one SQLite database in WAL mode.
+
+    Saves upsert only the new signatures, all in one transaction, and trim
+    each history back to max_size (and ttl, if set) with indexed deletes.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sent (
+            kind TEXT NOT NULL,
+            chain_id TEXT NOT NULL,
+            token_address TEXT NOT NULL,
+            signature TEXT NOT NULL,
+            sent_at REAL NOT NULL,
+            PRIMARY KEY (kind, chain_id, token_address)
+        );
+        CREATE INDEX IF NOT EXISTS sent_by_age ON sent (kind, sent_at);
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            registered_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            chat_id INTEGER PRIMARY KEY,
+            settings TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path=SQLITE_PATH, max_size=None, ttl=0):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def transaction(self, statements):
+        """Run [(sql, params or [params, ...]), ...] atomically."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self.conn.executemany(sql, params)
+                    else:
+                        self.conn.execute(sql, params)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def get_meta(self, key):
+        rows = self.execute("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key, value):
+        self.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def load_signatures(self, kind):
+        rows = self.execute("SELECT signature FROM sent WHERE kind = ? ORDER BY sent_at", (kind,))
+        return [json.loads(row[0]) for row in rows]
+
+    def save_signatures(self, kind, new_signatures, all_signatures=None):
+        now = time.time()
+        rows = [
+            (kind, str(sig["chainId"]), str(sig["tokenAddress"]), json.dumps(dict(sig)), now + i * 1e-6)
+            for i, sig in enumerate(new_signatures)
+        ]
+        statements = [(
+            "INSERT INTO sent (kind, chain_id, token_address, signature, sent_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (kind, chain_id, token_address) DO UPDATE SET "
+            "signature = excluded.signature, sent_at = excluded.sent_at",
+            rows,
+        )]
+        if self.max_size:
+            statements.append((
+                "DELETE FROM sent WHERE kind = ? AND sent_at < ("
+                "SELECT sent_at FROM sent WHERE kind = ? ORDER BY sent_at DESC LIMIT 1 OFFSET ?)",
+                (kind, kind, self.max_size - 1),
+            ))
+        if self.ttl:
+            statements.append(("DELETE FROM sent WHERE kind = ? AND sent_at < ?", (kind, now - self.ttl)))
+        self.transaction(statements)
+
+    def load_chats(self):
+        return {row[0] for row in self.execute("SELECT chat_id FROM chats")}
+
+    def save_chats(self, chat_ids):
+        chat_ids = set(chat_ids)
+        removed = self.load_chats() - chat_ids
+        now = time.time()
+        self.transaction([
+            ("INSERT OR IGNORE INTO chats (chat_id, registered_at) VALUES (?, ?)",
+             [(chat_id, now) for chat_id in chat_ids]),
+            ("DELETE FROM chats WHERE chat_id = ?", [(chat_id,) for chat_id in removed]),
+        ])
+
+    def update_chats(self, added, removed):
+        now = time.time()
+        self.transaction([
+            ("INSERT OR IGNORE INTO chats (chat_id, registered_at) VALUES (?, ?)",
+             [(chat_id, now) for chat_id in added]),
+            ("DELETE FROM chats WHERE chat_id = ?", [(chat_id,) for chat_id in removed]),
+        ])
+
+    def load_subscriptions(self):
+        return {row[0]: json.loads(row[1]) for row in self.execute("SELECT chat_id, settings FROM subscriptions")}
+
+    def save_subscription(self, chat_id, settings):
+        if settings:
+            self.execute(
+                "INSERT OR REPLACE INTO subscriptions (chat_id, settings, updated_at) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(settings), time.time()))
+        else:
+            self.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def import_json_files(store, files, chat_file, force=False):
+    """One-shot copy of the legacy JSON histories and chat list into a SQLite store."""
+    if store.get_meta("json_imported") and not force:
+        return False
+    legacy = JsonStorage(files, chat_file)
+    for kind in files:
+        signatures = legacy.load_signatures(kind)
+        if signatures:
+            store.save_signatures(kind, signatures)
+            print(f"📥 Imported {len(signatures)} {kind} signatures from {files[kind]}")
+    chats = legacy.load_chats()
+    if chats:
+        store.save_chats(store.load_chats() | chats)
+        print(f"📥 Imported {len(chats)} registered chats from {chat_file}")
+    for chat_id, settings in legacy.load_subscriptions().items():
+        store.save_subscription(chat_id, settings)
+    store.set_meta("json_imported", str(time.time()))
+    return True
+
+
+def open_storage(files, chat_file, max_size=None, ttl=0, backend=STORAGE_BACKEND):
+    if backend == "sqlite":
+        store = SqliteStorage(SQLITE_PATH, max_size=max_size, ttl=ttl)
+        import_json_files(store, files, chat_file)
+        return store
+    if backend != "json":
+        print(f"⚠️ Unknown STORAGE_BACKEND {backend!r}, using json")
+    return JsonStorage(files, chat_file, max_size=max_size)
+
+
+if __name__ == "__main__":
+    # python storage.py import  -> (re)import the JSON files into SQLITE_PATH
+    from funct import SENT_FILES, CHAT_FILE, MAX_TOKENS, SENT_TTL
+
+    if sys.argv[1:] != ["import"]:
+        print("usage: python storage.py import")
+        sys.exit(1)
+    import_json_files(SqliteStorage(SQLITE_PATH, MAX_TOKENS, SENT_TTL), SENT_FILES, CHAT_FILE, force=True)
@@ -0,0 +1,200 @@
+import math
+import time
+from bisect import bisect_right
+
+
+# Settings a channel can send as "/filter key=value ...". Anything not set matches everything.
+#   feeds=tokens,boosts   chains=solana,base   min_liq=25k   min_mc=1.5m   max_age=24h   min_boosts=100
+SETTING_ALIASES = {
+    "feeds": "feeds", "feed": "feeds",
+    "chains": "chains", "chain": "chains",
+    "min_liq": "min_liquidity", "min_liquidity": "min_liquidity",
+    "min_mc": "min_market_cap", "min_market_cap": "min_market_cap",
+    "max_age": "max_age",
+    "min_boosts": "min_boosts",
+}
+NUMBER_SUFFIXES = {"k": 1e3, "m": 1e6, "b": 1e9}
+AGE_SUFFIXES = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Every threshold is stored as "bound <= value", so one sorted list and a bisect
+# answer it: max_age becomes -max_age <= -age. min_boosts only applies to boost alerts.
+DIMENSIONS = ("min_liquidity", "min_market_cap", "max_age", "min_boosts")
+
+
+def parse_number(text, suffixes=NUMBER_SUFFIXES):
+    text = text.strip().lower().replace(",", "").lstrip("$")
+    scale = 1
+    if text and text[-1] in suffixes:
+        scale = suffixes[text[-1]]
+        text = text[:-1]
+    return float(text) * scale
+
+
+def parse_settings(args, feeds):
+    """Turn "/filter" arguments into a settings dict; raises ValueError with a message for the channel."""
+    settings = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        name = SETTING_ALIASES.get(key.strip().lower())
+        if not sep or name is None:
+            raise ValueError(f"Unknown setting {arg!r}")
+        if name in ("feeds", "chains"):
+            values = sorted({v.strip().lower() for v in value.split(",") if v.strip()})
+            if name == "feeds" and not set(values) <= set(feeds):
+                raise ValueError(f"Feeds must be among: {', '.join(feeds)}")
+            settings[name] = values
+        elif name == "max_age":
+            settings[name] = parse_number(value, AGE_SUFFIXES)
+        else:
+            settings[name] = parse_number(value)
+    return settings
+
+
+def describe_settings(settings):
+    if not settings:
+        return "all alerts"
+    parts = []
+    for key, value in sorted(settings.items()):
+        if isinstance(value, list):
+            value = ",".join(value)
+        elif key == "max_age":
+            value = f"{value / 3600:g}h"
+        else:
+            value = f"{value:,.0f}"
+        parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+def _number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+def alert_values(feed, record, now=None):
+    """The record's value for each dimension, or None where it is unknown."""
+    created = _number(record.get("pairCreatedAt"))
+    now = time.time() if now is None else now
+    return (
+        _number(record.get("liquidity")),
+        _number(record.get("marketCap")),
+        -(now - created / 1000) if created else None,
+        _number(record.get("totalAmount")) if feed == "boosts" else None,
+    )
+
+
+def settings_bounds(feed, settings):
+    bounds = []
+    for name in DIMENSIONS:
+        value = settings.get(name)
+        if value is None or (name == "min_boosts" and feed != "boosts"):
+            bounds.append(-math.inf)
+        else:
+            bounds.append(-value if name == "max_age" else value)
+    return tuple(bounds)
+
+
+class _Bucket:
+    """The chats subscribed to one (feed, chain): the unfiltered ones as a plain
+    list, the rest as one sorted bound list per dimension."""
+
+    __slots__ = ("open", "filtered", "sorted_bounds", "sorted_chats")
+
+    def __init__(self):
+        self.open = []
+        self.filtered = {}
+
+    def add(self, chat_id, bounds):
+        if all(bound == -math.inf for bound in bounds):
+            self.open.append(chat_id)
+        else:
+            self.filtered[chat_id] = bounds
+
+    def freeze(self):
+        self.sorted_bounds, self.sorted_chats = [], []
+        for dim in range(len(DIMENSIONS)):
+            ordered = sorted(self.filtered.items(), key=lambda item: item[1][dim])
+            self.sorted_bounds.append([bounds[dim] for _, bounds in ordered])
+            self.sorted_chats.append([chat_id for chat_id, _ in ordered])
+
+    def match(self, values):
+        yield from self.open
+        if not self.filtered:
+            return
+        # A chat passes a dimension when its bound <= the alert's value, i.e. it is in that
+        # dimension's sorted prefix. Walk the shortest prefix and check the rest per chat.
+        keys = [-math.inf if value is None else value for value in values]
+        prefixes = [bisect_right(self.sorted_bounds[dim], keys[dim]) for dim in range(len(DIMENSIONS))]
+        dim = min(range(len(DIMENSIONS)), key=prefixes.__getitem__)
+        for chat_id in self.sorted_chats[dim][:prefixes[dim]]:
+            bounds = self.filtered[chat_id]
+            if all(bound <= key for bound, key in zip(bounds, keys)):
+                yield chat_id
+
+
+class SubscriptionIndex:
+    """Which registered chats want an alert, without looking at every chat.
+
+    Chats are compiled into one bucket per (feed, chain) plus a per-feed
+    bucket for chats that take every chain; within a bucket thresholds are
+    sorted so a lookup is a bisect per dimension. The index is rebuilt on the
+    next lookup after ``invalidate()``.
+    """
+
+    def __init__(self, chat_ids, settings, feeds):
+        self.chat_ids = chat_ids
+        self.settings = settings
+        self.feeds = list(feeds)
+        self.buckets = None
+        self.rebuilds = 0
+
+    def invalidate(self):
+        self.buckets = None
+
+    def get(self, chat_id):
+        return self.settings.get(chat_id, {})
+
+    def set(self, chat_id, settings):
+        if settings:
+            self.settings[chat_id] = settings
+        else:
+            self.settings.pop(chat_id, None)
+        self.invalidate()
+
+    def _build(self):
+        buckets = {}
+        for chat_id in self.chat_ids:
+            settings = self.settings.get(chat_id, {})
+            chains = settings.get("chains") or ["*"]
+            for feed in settings.get("feeds") or self.feeds:
+                bounds = settings_bounds(feed, settings)
+                for chain in chains:
+                    bucket = buckets.get((feed, chain))
+                    if bucket is None:
+                        bucket = buckets[(feed, chain)] = _Bucket()
+                    bucket.add(chat_id, bounds)
+        for bucket in buckets.values():
+            bucket.freeze()
+        self.buckets = buckets
+        self.rebuilds += 1
+
+    def match(self, feed, record):
+        """Registered chats whose settings accept this alert."""
+        if self.buckets is None:
+            self._build()
+        values = alert_values(feed, record)
+        chain = str(record.get("chainId", "")).lower()
+        matched = []
+        for key in ((feed, "*"), (feed, chain)):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                matched.extend(bucket.match(values))
+        return matched
+
+    def stats(self):
+        return {
+            "chats": len(self.chat_ids),
+            "filtered": len(self.settings),
+            "buckets": len(self.buckets or ()),
+            "rebuilds": self.rebuilds,
+        }
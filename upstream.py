@@ -0,0 +1,222 @@
+import asyncio
+import os
+import time
+from collections import deque
+
+import httpx
+from dotenv import load_dotenv
+
+from http_client import get_client
+from metrics import Gauge, UPSTREAM_ERRORS, UPSTREAM_HEDGES, UPSTREAM_SECONDS
+
+
+load_dotenv()
+
+# connect/read deadlines in seconds per endpoint, overridable as "feed=3/10,pairs=3/8,image=5/20".
+DEFAULT_TIMEOUTS = {"feed": (5, 15), "pairs": (5, 10), "image": (5, 20)}
+UPSTREAM_TIMEOUTS = os.environ.get("UPSTREAM_TIMEOUTS", "")
+# A request still running after the endpoint's observed p95 gets one duplicate; the first answer wins.
+UPSTREAM_HEDGE = os.environ.get("UPSTREAM_HEDGE", "1") != "0"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", 95))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", 20))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", 0.05))
+# Hedges may add at most this share of extra requests per endpoint.
+HEDGE_BUDGET = float(os.environ.get("HEDGE_BUDGET", 0.1))
+# A host that fails this many times in a row is not called for CIRCUIT_COOLDOWN seconds.
+CIRCUIT_FAILURES = int(os.environ.get("CIRCUIT_FAILURES", 5))
+CIRCUIT_COOLDOWN = float(os.environ.get("CIRCUIT_COOLDOWN", 30))
+
+
+def parse_timeouts(spec, defaults=DEFAULT_TIMEOUTS):
+    timeouts = dict(defaults)
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        connect, _, read = value.partition("/")
+        timeouts[name.strip()] = (float(connect), float(read or connect))
+    return timeouts
+
+
+TIMEOUTS = parse_timeouts(UPSTREAM_TIMEOUTS)
+
+
+class CircuitOpen(Exception):
+    """The host failed repeatedly and is not being called right now."""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"circuit open for {host}, retry in {retry_after:.0f}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class LatencyWindow:
+    """The last ``size`` latencies of one endpoint and its hedging budget."""
+
+    def __init__(self, size=200):
+        self.samples = deque(maxlen=size)
+        self.requests = 0
+        self.hedges = 0
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+
+    def percentile(self, p):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None if there is no basis or budget for it."""
+        if not UPSTREAM_HEDGE or len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        if self.hedges >= HEDGE_BUDGET * self.requests:
+            return None
+        return max(HEDGE_MIN_DELAY, self.percentile(HEDGE_PERCENTILE))
+
+
+class CircuitBreaker:
+    """closed -> open after ``threshold`` consecutive failures -> half open after ``cooldown``,
+    where a single probe decides between closed and open again."""
+
+    def __init__(self, threshold=CIRCUIT_FAILURES, cooldown=CIRCUIT_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.trips = 0
+
+    def allow(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_in(self):
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def on_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def on_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+breakers = {}
+windows = {}
+
+
+def get_breaker(host):
+    breaker = breakers.get(host)
+    if breaker is None:
+        breaker = breakers[host] = CircuitBreaker()
+    return breaker
+
+
+def get_window(endpoint):
+    window = windows.get(endpoint)
+    if window is None:
+        window = windows[endpoint] = LatencyWindow()
+    return window
+
+
+def is_host_failure(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+
+async def _send(url, headers, timeout):
+    start = time.perf_counter()
+    response = await get_client().get(url, headers=headers, timeout=timeout)
+    return response, time.perf_counter() - start
+
+
+async def _hedged(endpoint, url, headers, timeout):
+    window = get_window(endpoint)
+    window.requests += 1
+    primary = asyncio.ensure_future(_send(url, headers, timeout))
+    running = {primary}
+    error = None
+    try:
+        delay = window.hedge_delay()
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait(running, timeout=delay)
+        if done:
+            return primary.result()
+
+        window.hedges += 1
+        hedge = asyncio.ensure_future(_send(url, headers, timeout))
+        running.add(hedge)
+        while running:
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    UPSTREAM_HEDGES.labels(endpoint, "hedge" if task is hedge else "primary").inc()
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # Also reached when the caller is cancelled mid-wait: no request outlives it.
+        for task in running:
+            task.cancel()
+
+
+async def get(endpoint, url, headers=None):
+    """GET ``url`` with the endpoint's deadlines, hedging and its host's circuit breaker.
+
+    Returns the response (any status); raises CircuitOpen without a request
+    while the host is failing, or the httpx error of a failed request.
+    """
+    host = httpx.URL(url).host
+    breaker = get_breaker(host)
+    if not breaker.allow():
+        UPSTREAM_ERRORS.labels(endpoint, "circuit_open").inc()
+        raise CircuitOpen(host, breaker.retry_in())
+
+    connect, read = TIMEOUTS.get(endpoint, DEFAULT_TIMEOUTS["feed"])
+    timeout = httpx.Timeout(read, connect=connect)
+    try:
+        response, seconds = await _hedged(endpoint, url, headers, timeout)
+    except httpx.HTTPError as e:
+        UPSTREAM_ERRORS.labels(endpoint, type(e).__name__).inc()
+        breaker.on_failure()
+        raise
+    finally:
+        # Cancellation or any other error says nothing about the host; free the probe slot
+        # either way, or a half-open breaker would never let another request through.
+        breaker.probing = False
+    if is_host_failure(response):
+        breaker.on_failure()
+    else:
+        breaker.on_success()
+        get_window(endpoint).observe(seconds)
+    UPSTREAM_SECONDS.labels(endpoint).observe(seconds)
+    return response
+
+
+def stats():
+    return {
+        "hosts": {host: breaker.state for host, breaker in breakers.items()},
+        "trips": sum(breaker.trips for breaker in breakers.values()),
+        "hedges": {endpoint: window.hedges for endpoint, window in windows.items()},
+        "p95": {endpoint: round(window.percentile(95) or 0, 3) for endpoint, window in windows.items()},
+    }
+
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+Gauge("dexmonitor_upstream_circuit_state", "Circuit breaker per upstream host (0 closed, 1 half open, 2 open).",
+      ("host",), callback=lambda: {(host,): CIRCUIT_STATES[b.state] for host, b in list(breakers.items())})